@@ -0,0 +1,14 @@
+import os, tempfile
+
+# main.py reads its settings at import time: keep tests off Supabase and out of the working tree
+TMP_DIR = tempfile.mkdtemp(prefix="satellite-tests-")
+os.environ.update({
+    "SUPABASE_URL": "http://127.0.0.1:9",
+    "SUPABASE_SERVICE_KEY": "test",
+    "STORAGE_BACKEND": "sqlite",
+    "STORAGE_PATH": os.path.join(TMP_DIR, "satellites.db"),
+    "PASS_STATE_FILE": "",
+    "CATALOG_CACHE_DIR": "",
+    "CATALOG_FILES": "",
+    "GROUND_STATIONS_FILE": "",
+})
@@ -1,8 +1,18 @@
-import os, time, math, requests, json, threading
+import os, time, math, requests, json, threading, asyncio, csv, uuid, hashlib, sqlite3, glob, operator
+from contextlib import asynccontextmanager, suppress
+import numpy as np
+from numpy.polynomial import chebyshev
+from collections import deque, OrderedDict
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timezone, timedelta
 from dotenv import load_dotenv
-from sgp4.api import Satrec, jday
-from fastapi import FastAPI
+from sgp4.api import Satrec, SatrecArray, WGS72, jday
+from sgp4 import omm
+from fastapi import FastAPI, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 
 # ----------------- LOAD ENV -----------------
 load_dotenv()
@@ -11,17 +21,95 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 
 UPDATE_INTERVAL = int(os.getenv("UPDATE_INTERVAL", 10))  # seconds between automatic updates
+UPDATE_POLICY = os.getenv("UPDATE_POLICY", "skip")  # "skip" missed ticks or "catchup" by running them back to back
+UPDATE_MAX_CATCHUP = int(os.getenv("UPDATE_MAX_CATCHUP", 3))  # most missed ticks replayed in catchup mode
+PRECOMPUTE_WORKERS = int(os.getenv("PRECOMPUTE_WORKERS", 4))  # satellites precomputed in parallel at startup
+
+ORBIT_PATH_MODE = os.getenv("ORBIT_PATH_MODE", "incremental")  # "incremental" rolling window or "full" one-shot rebuild
+ORBIT_PATH_MINUTES = int(os.getenv("ORBIT_PATH_MINUTES", 30))  # length of the future path window
+ORBIT_PATH_STEP = int(os.getenv("ORBIT_PATH_STEP", 30))  # seconds between path points
+ORBIT_PATH_REFRESH = int(os.getenv("ORBIT_PATH_REFRESH", 60))  # seconds between window advances
+ORBIT_PATH_DELETE_IDS = int(os.getenv("ORBIT_PATH_DELETE_IDS", 100))  # satellites per expiry delete request
+
+PASS_HORIZON_MODE = os.getenv("PASS_HORIZON_MODE", "rolling")  # "rolling" extend-only horizon or "fixed" one-shot rebuild
+PASS_HORIZON_HOURS = float(os.getenv("PASS_HORIZON_HOURS", 24))  # how far ahead passes are kept predicted
+PASS_EXTEND_INTERVAL = int(os.getenv("PASS_EXTEND_INTERVAL", 900))  # seconds between horizon extensions
+EPHEMERIS_SEGMENT = int(os.getenv("EPHEMERIS_SEGMENT", 600))  # seconds covered by one Chebyshev segment
+EPHEMERIS_DEGREE = int(os.getenv("EPHEMERIS_DEGREE", 8))  # polynomial degree per segment (degree + 1 SGP4 samples)
+EPHEMERIS_TOL_KM = float(os.getenv("EPHEMERIS_TOL_KM", 0.001))  # max position error vs SGP4 before falling back to SGP4
+EPHEMERIS_TOL_KMS = float(os.getenv("EPHEMERIS_TOL_KMS", 1e-6))  # max velocity error vs SGP4
+EPHEMERIS_CACHE_MB = float(os.getenv("EPHEMERIS_CACHE_MB", 64))  # memory budget for cached segments
+POSITION_QUANTUM = float(os.getenv("POSITION_QUANTUM", 1))  # seconds position queries are rounded to before caching
+POSITION_CACHE_SIZE = int(os.getenv("POSITION_CACHE_SIZE", 200000))  # cached (satellite, time) positions
+POSITION_MAX_POINTS = int(os.getenv("POSITION_MAX_POINTS", 10000))  # timestamps per batch position request
+
+PASS_STATE_FILE = os.getenv("PASS_STATE_FILE", "pass_horizon.json")  # scan progress persisted across restarts ("" disables)
+
+SUPABASE_MAX_BATCH_ROWS = int(os.getenv("SUPABASE_MAX_BATCH_ROWS", 500))  # rows per bulk insert request
+SUPABASE_MAX_BATCH_BYTES = int(os.getenv("SUPABASE_MAX_BATCH_BYTES", 1_000_000))  # JSON body size per bulk insert request
+SUPABASE_POOL_SIZE = int(os.getenv("SUPABASE_POOL_SIZE", 10))  # keep-alive connections kept per host
+SUPABASE_CONNECT_TIMEOUT = float(os.getenv("SUPABASE_CONNECT_TIMEOUT", 5))  # seconds
+SUPABASE_READ_TIMEOUT = float(os.getenv("SUPABASE_READ_TIMEOUT", 30))  # seconds
+SUPABASE_RETRIES = int(os.getenv("SUPABASE_RETRIES", 3))  # retries on connection errors, 429 and 5xx
+SUPABASE_BACKOFF = float(os.getenv("SUPABASE_BACKOFF", 0.5))  # exponential backoff factor between retries
+
+WRITE_QUEUE_MAX_ROWS = int(os.getenv("WRITE_QUEUE_MAX_ROWS", 10000))  # pending rows before producers block
+WRITE_QUEUE_FLUSH_ROWS = int(os.getenv("WRITE_QUEUE_FLUSH_ROWS", 500))  # flush a table once this many rows are pending
+WRITE_QUEUE_FLUSH_AGE = float(os.getenv("WRITE_QUEUE_FLUSH_AGE", 2))  # seconds the oldest pending row may wait
+WRITE_QUEUE_PUT_TIMEOUT = float(os.getenv("WRITE_QUEUE_PUT_TIMEOUT", 1))  # seconds to block on a full queue before dropping
+
+STATE_MODE = os.getenv("STATE_MODE", "append")  # "append" a satellite_state row per tick or "latest" upsert one row per satellite
+STATE_HISTORY_TABLE = os.getenv("STATE_HISTORY_TABLE", "satellite_state_history")  # history table in latest mode ("" disables)
+STATE_HISTORY_INTERVAL = float(os.getenv("STATE_HISTORY_INTERVAL", 60))  # seconds between history rows per satellite (0 keeps every tick)
+STATE_ROLLUP = os.getenv("STATE_ROLLUP", "0") == "1"  # also write one row per satellite per minute/hour to <history>_1m and <history>_1h
+
+RETENTION_INTERVAL = int(os.getenv("RETENTION_INTERVAL", 0))  # seconds between retention runs (0 disables)
+RETENTION_RAW_HOURS = float(os.getenv("RETENTION_RAW_HOURS", 24))  # age after which full-rate history rows are deleted
+RETENTION_MINUTE_DAYS = float(os.getenv("RETENTION_MINUTE_DAYS", 7))  # age after which per-minute rollup rows are deleted
+RETENTION_HOUR_DAYS = float(os.getenv("RETENTION_HOUR_DAYS", 365))  # age after which per-hour rollup rows are deleted (0 keeps forever)
+RETENTION_SLICE = int(os.getenv("RETENTION_SLICE", 900))  # seconds of history removed per delete request
+RETENTION_MAX_SLICES = int(os.getenv("RETENTION_MAX_SLICES", 100))  # delete requests per table per run
+
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase")  # "supabase" REST, "postgres" (COPY), "sqlite" or "parquet"; postgres/parquet need requirements-storage.txt
+STORAGE_DSN = os.getenv("STORAGE_DSN", "")  # Postgres connection string for the postgres backend
+STORAGE_PATH = os.getenv("STORAGE_PATH", "")  # SQLite file or Parquet directory; defaults to satellites.db / data
+
+SPOOL_PATH = os.getenv("SPOOL_PATH", "spool.db")  # SQLite spool for batches Supabase could not take ("" disables)
+SPOOL_MAX_MB = float(os.getenv("SPOOL_MAX_MB", 256))  # spooled JSON kept on disk before the oldest batches are evicted
+SPOOL_REPLAY_INTERVAL = int(os.getenv("SPOOL_REPLAY_INTERVAL", 15))  # seconds between replay attempts
+SPOOL_REPLAY_RATE = float(os.getenv("SPOOL_REPLAY_RATE", 2000))  # rows per second replayed at most
+# {table: "col1,col2"} replayed with on_conflict so rows an earlier attempt already wrote are skipped.
+# Each listed key needs a matching unique constraint, e.g. for the default tables:
+#   satellite_state / orbit_path / satellite_state_history(_1m/_1h): UNIQUE (satellite_id, timestamp)
+#   passes: UNIQUE (satellite_id, aos), or (satellite_id, station_id, aos) with PASS_MODE=network
+# Tables not listed are replayed as plain inserts.
+SPOOL_REPLAY_KEYS = json.loads(os.getenv("SPOOL_REPLAY_KEYS", "{}"))
+
+STREAM_MAX_RATE = float(os.getenv("STREAM_MAX_RATE", 1))  # highest frames per second a stream client may request
+STREAM_MAX_CLIENTS = int(os.getenv("STREAM_MAX_CLIENTS", 1000))  # concurrent WebSocket/SSE subscribers
+STREAM_HEARTBEAT = float(os.getenv("STREAM_HEARTBEAT", 15))  # seconds between SSE keep-alive comments
+
+# ----------------- CATALOG -----------------
+CATALOG_FILES = os.getenv("CATALOG_FILES", "")  # comma-separated 2LE/3LE/OMM (.json/.csv/.xml) files; empty uses SAT_INSTANCES
+CATALOG_WATCH_INTERVAL = int(os.getenv("CATALOG_WATCH_INTERVAL", 0))  # seconds between catalog file checks (0 disables)
+CATALOG_CACHE_DIR = os.getenv("CATALOG_CACHE_DIR", ".catalog_cache")  # parsed catalog snapshots ("" disables)
+SAT_ID_NAMESPACE = uuid.UUID(os.getenv("SAT_ID_NAMESPACE", "6f1c3a52-4f9e-4a8e-9d1b-5b0f4e2c7a10"))  # uuid5 namespace for catalog ids
 
 # ----------------- GROUND STATION -----------------
 GS_LAT = math.radians(float(os.getenv("GS_LAT", "9.984780")))
 GS_LON = math.radians(float(os.getenv("GS_LON", "76.477498")))
 GS_ALT = float(os.getenv("GS_ALT", 0))  # meters
 MIN_ELEV = float(os.getenv("MIN_ELEVATION", 10))  # degrees
+GS_ID = os.getenv("GS_ID", "default")
+GROUND_STATIONS_FILE = os.getenv("GROUND_STATIONS_FILE")  # JSON list of {"id", "name", "lat", "lon", "alt", "min_elevation"}
 
 EARTH_RADIUS = 6378.137  # km
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
 
 # ----------------- SATELLITES CONFIG -----------------
 # Each satellite: {"id": Supabase UUID, "name": str, "tle1": str, "tle2": str, "sat": Satrec}
+# (catalog-loaded satellites may carry "omm" fields instead of TLE lines)
 SAT_INSTANCES = [
     {
         "id": os.getenv("SAT1_ID", "a03f7556-094b-44c8-991c-2f376de988d3"),
@@ -46,145 +134,2597 @@ SAT_INSTANCES = [
 # Initialize Satrec objects
 for s in SAT_INSTANCES:
     s["sat"] = Satrec.twoline2rv(s["tle1"], s["tle2"])
+    s["norad_id"] = s["sat"].satnum
+    s["epoch"] = s["sat"].jdsatepoch + s["sat"].jdsatepochF
+    s["elements_hash"] = hashlib.sha1(f"{s['tle1']}\n{s['tle2']}".encode()).hexdigest()
+
+# ----------------- CATALOG LOADER -----------------
+ALPHA5 = "ABCDEFGHJKLMNPQRSTUVWXYZ"  # Alpha-5 leading letters (no I or O) for NORAD ids >= 100000
+
+def parse_norad_id(field):
+    field = field.strip()
+    if field and field[0].isalpha():
+        return (ALPHA5.index(field[0].upper()) + 10) * 10000 + int(field[1:])
+    return int(field)
+
+@lru_cache(maxsize=None)
+def year_start_jd(yy):
+    year = 2000 + yy if yy < 57 else 1900 + yy
+    jd, fr = jday(year, 1, 1, 0, 0, 0)
+    return jd + fr
+
+def tle_epoch_jd(line1):
+    return year_start_jd(int(line1[18:20])) + float(line1[20:32]) - 1
+
+def omm_epoch_jd(epoch):
+    t = datetime.fromisoformat(str(epoch).rstrip("Z"))
+    jd, fr = jday(t.year, t.month, t.day, t.hour, t.minute, t.second + t.microsecond / 1e6)
+    return jd + fr
+
+def parse_tle_text(text):
+    # Yields (name or None, line1, line2) from 2LE or 3LE text
+    name = None
+    lines = [line.rstrip() for line in text.splitlines() if line.strip()]
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith("1 ") and i + 1 < len(lines) and lines[i + 1].startswith("2 "):
+            yield name, line, lines[i + 1]
+            name = None
+            i += 2
+            continue
+        name = line[2:].strip() if line.startswith("0 ") else line.strip()
+        i += 1
+
+def parse_omm_file(path, ext):
+    # Yields OMM field dicts from CCSDS OMM JSON, CSV or XML
+    if ext == ".xml":
+        yield from omm.parse_xml(path)
+        return
+    with open(path, newline="") as f:
+        if ext == ".csv":
+            yield from csv.DictReader(f)
+            return
+        data = json.load(f)
+    yield from (data if isinstance(data, list) else [data])
+
+def catalog_id(norad_id):
+    # uuid5(SAT_ID_NAMESPACE, "norad:<id>"), formatted without building a UUID object
+    digest = bytearray(hashlib.sha1(SAT_ID_NAMESPACE.bytes + f"norad:{norad_id}".encode()).digest()[:16])
+    digest[6] = (digest[6] & 0x0F) | 0x50
+    digest[8] = (digest[8] & 0x3F) | 0x80
+    h = digest.hex()
+    return f"{h[:8]}-{h[8:12]}-{h[12:16]}-{h[16:20]}-{h[20:]}"
+
+def elements_hash(source):
+    # Identity of an element set, used to tell changed satellites apart on reload
+    if "omm" in source:
+        raw = json.dumps(source["omm"], sort_keys=True, default=str)
+    else:
+        raw = f"{source['tle1']}\n{source['tle2']}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+def build_satrec(entry):
+    if "omm" in entry:
+        sat = Satrec()
+        omm.initialize(sat, {k: str(v) for k, v in entry["omm"].items()})
+        return sat
+    return Satrec.twoline2rv(entry["tle1"], entry["tle2"])
+
+def load_catalog(paths, reuse=None):
+    # Reads every file, keeps the newest epoch per NORAD id, then builds Satrecs for the survivors only.
+    # `reuse` maps id -> current entry; entries whose elements are unchanged keep their Satrec
+    newest = {}  # norad id -> (epoch, name, source fields)
+    skipped = 0
+
+    def offer(norad_id, epoch, name, source):
+        held = newest.get(norad_id)
+        if held is None or epoch > held[0]:
+            newest[norad_id] = (epoch, name, source)
+
+    for path in paths:
+        ext = os.path.splitext(path)[1].lower()
+        try:
+            if ext in (".json", ".csv", ".xml"):
+                for fields in parse_omm_file(path, ext):
+                    try:
+                        offer(parse_norad_id(str(fields["NORAD_CAT_ID"])), omm_epoch_jd(fields["EPOCH"]),
+                              fields.get("OBJECT_NAME"), {"omm": fields})
+                    except (KeyError, ValueError):
+                        skipped += 1
+            else:
+                with open(path) as f:
+                    text = f.read()
+                for name, line1, line2 in parse_tle_text(text):
+                    try:
+                        offer(parse_norad_id(line1[2:7]), tle_epoch_jd(line1), name,
+                              {"tle1": line1, "tle2": line2})
+                    except ValueError:
+                        skipped += 1
+        except (OSError, ValueError) as exc:
+            print(f"[ERROR] Catalog {path}: {exc}")
+    catalog = []
+    for norad_id, (epoch, name, source) in newest.items():
+        entry = {
+            "id": catalog_id(norad_id),
+            "name": name or f"NORAD {norad_id}",
+            "norad_id": norad_id,
+            "epoch": epoch,
+            "elements_hash": elements_hash(source),
+            **source
+        }
+        held = (reuse or {}).get(entry["id"])
+        if held is not None and held.get("elements_hash") == entry["elements_hash"]:
+            entry["sat"] = held["sat"]
+            catalog.append(entry)
+            continue
+        try:
+            entry["sat"] = build_satrec(entry)
+        except (KeyError, ValueError):
+            skipped += 1
+            continue
+        catalog.append(entry)
+    if skipped:
+        print(f"[WARN] Catalog: skipped {skipped} malformed element sets")
+    return catalog
+
+# ----------------- CATALOG SNAPSHOT -----------------
+SNAPSHOT_VERSION = 2
+SGP4_EPOCH0_JD = 2433281.5  # 1949-12-31 00:00 UT, the sgp4init epoch origin
+SNAPSHOT_ELEMENTS = ("bstar", "ndot", "nddot", "ecco", "argpo", "inclo", "mo", "no_kozai", "nodeo")
+SNAPSHOT_STRINGS = ("id", "name", "tle1", "tle2", "elements_hash")
+
+def catalog_hash(paths):
+    # Content hash of the source files and the id namespace, so any edit produces a new snapshot key
+    h = hashlib.sha256(f"v{SNAPSHOT_VERSION}\0{SAT_ID_NAMESPACE}".encode())
+    for path in paths:
+        h.update(path.encode() + b"\0")
+        with open(path, "rb") as f:
+            for block in iter(lambda: f.read(1 << 20), b""):
+                h.update(block)
+    return h.hexdigest()
+
+def save_catalog_snapshot(path, catalog):
+    sats = [s["sat"] for s in catalog]
+    arrays = {name: np.array([getattr(sat, name) for sat in sats], dtype=np.float64) for name in SNAPSHOT_ELEMENTS}
+    arrays["satnum"] = np.array([sat.satnum for sat in sats], dtype=np.int64)
+    arrays["epoch_days"] = np.array([sat.jdsatepoch - SGP4_EPOCH0_JD + sat.jdsatepochF for sat in sats])
+    arrays["epoch"] = np.array([s["epoch"] for s in catalog], dtype=np.float64)
+    arrays["norad_id"] = np.array([s["norad_id"] for s in catalog], dtype=np.int64)
+    for key in SNAPSHOT_STRINGS:
+        arrays[key] = np.array([s.get(key, "").encode() for s in catalog], dtype=np.bytes_)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, **arrays)
+    os.replace(tmp, path)
+    folder = os.path.dirname(path) or "."
+    for name in os.listdir(folder):
+        # snapshots of older catalog contents are never read again
+        if name.startswith("catalog-") and name.endswith(".npz") and name != os.path.basename(path):
+            os.remove(os.path.join(folder, name))
+
+def load_catalog_snapshot(path):
+    # Rebuilds Satrecs straight from stored elements with sgp4init: no text parsing or validation
+    with np.load(path, allow_pickle=False) as data:
+        columns = {k: data[k].tolist() for k in data.files}
+    for key in SNAPSHOT_STRINGS:
+        columns[key] = [b.decode() for b in columns[key]]
+    rows = zip(columns["satnum"], columns["epoch_days"], *(columns[name] for name in SNAPSHOT_ELEMENTS),
+               columns["epoch"], columns["norad_id"], *(columns[key] for key in SNAPSHOT_STRINGS))
+    catalog = []
+    for satnum, epoch_days, *elements, epoch, norad_id, sat_id, name, tle1, tle2, digest in rows:
+        sat = Satrec()
+        sat.sgp4init(WGS72, "i", satnum, epoch_days, *elements)
+        entry = {"id": sat_id, "name": name, "norad_id": norad_id, "epoch": epoch,
+                 "elements_hash": digest, "sat": sat}
+        if tle1:
+            entry["tle1"], entry["tle2"] = tle1, tle2
+        catalog.append(entry)
+    return catalog
+
+def load_catalog_cached(paths, cache_dir=None):
+    cache_dir = CATALOG_CACHE_DIR if cache_dir is None else cache_dir
+    if not cache_dir:
+        return load_catalog(paths)
+    try:
+        snapshot = os.path.join(cache_dir, f"catalog-{catalog_hash(paths)}.npz")
+    except OSError as exc:
+        print(f"[ERROR] Catalog hash: {exc}")
+        return load_catalog(paths)
+    if os.path.exists(snapshot):
+        try:
+            return load_catalog_snapshot(snapshot)
+        except (OSError, ValueError, KeyError) as exc:
+            print(f"[ERROR] Catalog snapshot {snapshot}: {exc}")
+    catalog = load_catalog(paths)
+    try:
+        save_catalog_snapshot(snapshot, catalog)
+    except OSError as exc:
+        print(f"[ERROR] Save catalog snapshot {snapshot}: {exc}")
+    return catalog
+
+def catalog_paths():
+    return [p.strip() for p in CATALOG_FILES.split(",") if p.strip()]
+
+if CATALOG_FILES:
+    t0 = time.perf_counter()
+    SAT_INSTANCES = load_catalog_cached(catalog_paths())
+    print(f"Loaded {len(SAT_INSTANCES)} satellites from catalog in {time.perf_counter() - t0:.2f}s")
+
+# ----------------- SUPABASE CLIENT -----------------
+class SupabaseClient:
+    # Pooled keep-alive sessions shared by every PostgREST call
+    RETRY_STATUSES = (429, 500, 502, 503, 504)
+    # Inserts are not idempotent: only retry when the request provably was not processed
+    POST_RETRY_STATUSES = (429, 503)
+
+    def __init__(self, url, key, pool_size=None, timeout=None, retries=None, backoff=None):
+        self.base_url = f"{url}/rest/v1"
+        self.timeout = timeout or (SUPABASE_CONNECT_TIMEOUT, SUPABASE_READ_TIMEOUT)
+        retries = SUPABASE_RETRIES if retries is None else retries
+        backoff = SUPABASE_BACKOFF if backoff is None else backoff
+        pool_size = pool_size or SUPABASE_POOL_SIZE
+        self.session = self._session(key, pool_size, Retry(
+            total=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.RETRY_STATUSES,
+            allowed_methods=frozenset(["GET", "PATCH", "DELETE"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        ))
+        # A POST that timed out or got a 5xx after the server committed it would be written twice on retry,
+        # so writes only retry connect failures and 429/503
+        self.write_session = self._session(key, pool_size, Retry(
+            total=retries,
+            connect=retries,
+            read=0,
+            other=0,
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=self.POST_RETRY_STATUSES,
+            allowed_methods=frozenset(["POST"]),
+            respect_retry_after_header=True,
+            raise_on_status=False
+        ))
+
+    @staticmethod
+    def _session(key, pool_size, retry):
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        session.headers.update({
+            "apikey": key,
+            "Authorization": f"Bearer {key}"
+        })
+        return session
+
+    def request(self, method, table, **kwargs):
+        kwargs.setdefault("timeout", self.timeout)
+        session = self.write_session if method == "POST" else self.session
+        return session.request(method, f"{self.base_url}/{table}", **kwargs)
+
+    def post(self, table, body, headers=None, params=None):
+        return self.request("POST", table, data=body, headers=headers, params=params)
+
+    def get(self, table, params):
+        return self.request("GET", table, params=params)
+
+    def delete(self, table, params):
+        return self.request("DELETE", table, params=params)
+
+    def close(self):
+        self.session.close()
+        self.write_session.close()
+
+SUPABASE = SupabaseClient(SUPABASE_URL, SUPABASE_KEY)
 
 # ----------------- SUPABASE HELPERS -----------------
-def supabase_insert(table, data):
-    url = f"{SUPABASE_URL}/rest/v1/{table}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}",
-        "Content-Type": "application/json",
-        "Prefer": "return=minimal"
-    }
-    r = requests.post(url, json=[data], headers=headers)
-    if not r.ok:
-        print(f"[ERROR] Insert {table}: {r.status_code} {r.text}")
+def chunk_rows(rows, max_rows=None, max_bytes=None):
+    # Yields lists of pre-serialized rows that fit both the row and byte limits
+    max_rows = max_rows or SUPABASE_MAX_BATCH_ROWS
+    max_bytes = max_bytes or SUPABASE_MAX_BATCH_BYTES
+    chunk, size = [], 2
+    for row in rows:
+        encoded = json.dumps(row)
+        n = len(encoded) + 1
+        if chunk and (len(chunk) >= max_rows or size + n > max_bytes):
+            yield chunk
+            chunk, size = [], 2
+        chunk.append(encoded)
+        size += n
+    if chunk:
+        yield chunk
 
-def supabase_delete(table, column, value):
-    url = f"{SUPABASE_URL}/rest/v1/{table}?{column}=eq.{value}"
-    headers = {
-        "apikey": SUPABASE_KEY,
-        "Authorization": f"Bearer {SUPABASE_KEY}"
-    }
-    r = requests.delete(url, headers=headers)
+INSERT_HEADERS = {
+    "Content-Type": "application/json",
+    "Prefer": "return=minimal"
+}
+
+UPSERT_HEADERS = {
+    "Content-Type": "application/json",
+    "Prefer": "resolution=merge-duplicates,return=minimal"
+}
+
+# Tables written as upserts, keyed by their unique column (PostgREST on_conflict)
+UPSERT_KEYS = {"satellite_state": "satellite_id"} if STATE_MODE == "latest" else {}
+
+def supabase_insert_many(table, rows, max_rows=None, max_bytes=None, on_conflict=None):
+    # One array POST per chunk; returns the number of rows accepted (written, or durably spooled).
+    # With on_conflict, rows matching an existing key are merged into it instead of failing.
+    # Upserts are never spooled: the next tick supersedes them and a late replay would overwrite newer rows.
+    headers = UPSERT_HEADERS if on_conflict else INSERT_HEADERS
+    params = {"on_conflict": on_conflict} if on_conflict else None
+    spool = None if on_conflict else SPOOL
+    written = 0
+    for i, chunk in enumerate(chunk_rows(rows, max_rows, max_bytes)):
+        body = "[" + ",".join(chunk) + "]"
+        if spool and spool.backlogged(table):
+            # keep per-table order: new batches wait behind the spooled ones
+            written += len(chunk) if spool.append(table, body, len(chunk)) else 0
+            continue
+        try:
+            r = SUPABASE.post(table, body, headers=headers, params=params)
+        except requests.RequestException as exc:
+            print(f"[ERROR] Insert {table} chunk {i} ({len(chunk)} rows): {exc}")
+            if spool and spool.append(table, body, len(chunk)):
+                written += len(chunk)
+            continue
+        if not r.ok:
+            print(f"[ERROR] Insert {table} chunk {i} ({len(chunk)} rows): {r.status_code} {r.text}")
+            # only outages and throttling are worth replaying; other errors would fail again
+            if spool and r.status_code in SupabaseClient.RETRY_STATUSES and spool.append(table, body, len(chunk)):
+                written += len(chunk)
+            continue
+        written += len(chunk)
+    return written
+
+def supabase_delete_where(table, filters):
+    # filters: PostgREST query params, e.g. {"timestamp": "lt.2024-01-01T00:00:00+00:00"}
+    try:
+        r = SUPABASE.delete(table, filters)
+    except requests.RequestException as exc:
+        print(f"[ERROR] Delete {table}: {exc}")
+        return False
     if not r.ok:
         print(f"[ERROR] Delete {table}: {r.status_code} {r.text}")
+        return False
+    return True
 
-# ----------------- MATH HELPERS -----------------
-def eci_to_latlon(r):
-    x, y, z = r
-    lon = math.atan2(y, x)
-    lat = math.atan2(z, math.sqrt(x*x + y*y))
-    alt = math.sqrt(x*x + y*y + z*z) - EARTH_RADIUS
-    return math.degrees(lat), math.degrees(lon), alt
+def supabase_select(table, params):
+    # Returns the decoded rows, or None on failure
+    try:
+        r = SUPABASE.get(table, params)
+    except requests.RequestException as exc:
+        print(f"[ERROR] Select {table}: {exc}")
+        return None
+    if not r.ok:
+        print(f"[ERROR] Select {table}: {r.status_code} {r.text}")
+        return None
+    return r.json()
 
+# ----------------- DURABLE SPOOL -----------------
+def replay_key(table):
+    # Only keys the operator declared: PostgREST rejects an on_conflict with no matching constraint (42P10)
+    return SPOOL_REPLAY_KEYS.get(table)
+
+REPLAY_HEADERS = {
+    "Content-Type": "application/json",
+    "Prefer": "resolution=ignore-duplicates,return=minimal"
+}
+
+def missing_constraint(r):
+    # PostgREST answers 400 / 42P10 when on_conflict names columns without a unique constraint
+    if r.status_code != 400:
+        return False
+    try:
+        return r.json().get("code") == "42P10"
+    except ValueError:
+        return False
+
+class WriteSpool:
+    # Append-only SQLite log of insert batches, replayed oldest first per table once Supabase accepts writes again.
+    # Each batch is keyed by a hash of its table and body, so a batch is spooled at most once.
+    def __init__(self, path, max_mb=None):
+        self.path = path
+        self.max_bytes = int((SPOOL_MAX_MB if max_mb is None else max_mb) * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("""CREATE TABLE IF NOT EXISTS spool (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            tbl TEXT NOT NULL,
+            key TEXT NOT NULL UNIQUE,
+            body TEXT NOT NULL,
+            rows INTEGER NOT NULL,
+            created REAL NOT NULL)""")
+        self.db.execute("CREATE INDEX IF NOT EXISTS spool_tbl ON spool (tbl, id)")
+        self.pending = {}  # table -> spooled batches
+        self.inflight = set()  # ids of batches currently being replayed
+        self.unkeyed = set()  # tables whose replay key turned out to have no unique constraint
+        self.bytes = 0
+        for tbl, n, size in self.db.execute("SELECT tbl, COUNT(*), SUM(LENGTH(body)) FROM spool GROUP BY tbl"):
+            self.pending[tbl] = n
+            self.bytes += size
+        self.counters = {"spooled": 0, "replayed": 0, "rejected": 0, "evicted": 0, "duplicates": 0}
+
+    def backlogged(self, table):
+        return self.pending.get(table, 0) > 0
+
+    def append(self, table, body, rows):
+        # Returns False only when the batch cannot be stored at all
+        key = hashlib.sha256(f"{table}\n{body}".encode()).hexdigest()
+        size = len(body)
+        if size > self.max_bytes:
+            print(f"[ERROR] Spool {table}: batch of {size} bytes exceeds SPOOL_MAX_MB")
+            return False
+        with self.lock:
+            try:
+                cur = self.db.execute("INSERT OR IGNORE INTO spool (tbl, key, body, rows, created) VALUES (?, ?, ?, ?, ?)",
+                                      (table, key, body, rows, time.time()))
+            except sqlite3.Error as exc:
+                print(f"[ERROR] Spool {table}: {exc}")
+                return False
+            if not cur.rowcount:
+                self.counters["duplicates"] += 1
+                return True
+            self.pending[table] = self.pending.get(table, 0) + 1
+            self.bytes += size
+            self.counters["spooled"] += rows
+            self._evict()
+        return True
+
+    def _evict(self):
+        # Drops the oldest batches (any table) until the spool fits its disk budget
+        # Batches being replayed are skipped; they leave the spool once their POST completes
+        while self.bytes > self.max_bytes:
+            skip = ",".join("?" * len(self.inflight))
+            row = self.db.execute(f"SELECT id, tbl, rows FROM spool WHERE id NOT IN ({skip}) ORDER BY id LIMIT 1",
+                                  list(self.inflight)).fetchone()
+            if row is None:
+                break
+            self._remove([row[0]])
+            self.counters["evicted"] += row[2]
+            print(f"[ERROR] Spool full: evicted {row[2]} {row[1]} rows")
+
+    def _remove(self, ids):
+        # Deletes whichever of ids are still spooled; returns the number of rows they held
+        marks = ",".join("?" * len(ids))
+        found = self.db.execute(f"SELECT tbl, rows, LENGTH(body) FROM spool WHERE id IN ({marks})", ids).fetchall()
+        self.db.execute(f"DELETE FROM spool WHERE id IN ({marks})", ids)
+        removed = 0
+        for table, rows, size in found:
+            self.pending[table] -= 1
+            if not self.pending[table]:
+                del self.pending[table]
+            self.bytes -= size
+            removed += rows
+        return removed
+
+    def _batch(self, table, max_rows, max_bytes):
+        # Consecutive oldest batches of one table, merged up to the bulk insert limits and marked in flight
+        with self.lock:
+            entries = self.db.execute("SELECT id, body, rows FROM spool WHERE tbl = ? ORDER BY id LIMIT 1000",
+                                      (table,)).fetchall()
+            ids, parts, rows, size = [], [], 0, 0
+            for id_, body, n in entries:
+                if ids and (rows + n > max_rows or size + len(body) > max_bytes):
+                    break
+                ids.append(id_)
+                parts.append(body[1:-1])
+                rows += n
+                size += len(body)
+            self.inflight.update(ids)
+        return ids, "[" + ",".join(parts) + "]", rows
+
+    def replay(self, budget_rows=None, rate=None):
+        # TickScheduler job: replays up to budget_rows, paced to rate rows/s; a table stops at its first failure
+        rate = rate or SPOOL_REPLAY_RATE
+        budget = budget_rows or int(rate * SPOOL_REPLAY_INTERVAL)
+        started = time.monotonic()
+        sent = 0
+        for table in sorted(self.pending, key=lambda t: self._oldest(t)):
+            key = None if table in self.unkeyed else replay_key(table)
+            while self.backlogged(table) and sent < budget:
+                ids, body, rows = self._batch(table, min(SUPABASE_MAX_BATCH_ROWS, budget - sent), SUPABASE_MAX_BATCH_BYTES)
+                if not ids:
+                    break
+                r = self._post(table, body, key)
+                if key and r is not None and missing_constraint(r):
+                    # misconfigured SPOOL_REPLAY_KEYS: fall back to plain inserts rather than drop the backlog
+                    print(f"[ERROR] Spool replay {table}: no unique constraint on ({key}); replaying as plain inserts")
+                    self.unkeyed.add(table)
+                    key = None
+                    r = self._post(table, body, key)
+                with self.lock:
+                    self.inflight.difference_update(ids)
+                    if r is None or (not r.ok and r.status_code in SupabaseClient.RETRY_STATUSES):
+                        self._evict()  # appends made while this batch was in flight may have overfilled the spool
+                        if r is not None:
+                            print(f"[ERROR] Spool replay {table}: {r.status_code} {r.text}")
+                        break
+                    self.counters["replayed" if r.ok else "rejected"] += self._remove(ids)
+                if not r.ok:
+                    print(f"[ERROR] Spool replay {table}: dropping {rows} rows rejected with {r.status_code} {r.text}")
+                sent += rows
+                wait = sent / rate - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+        return sent
+
+    def _post(self, table, body, key):
+        # Returns the response, or None when Supabase could not be reached
+        params = {"on_conflict": key} if key else None
+        try:
+            return SUPABASE.post(table, body, headers=REPLAY_HEADERS if key else INSERT_HEADERS, params=params)
+        except requests.RequestException as exc:
+            print(f"[ERROR] Spool replay {table}: {exc}")
+            return None
+
+    def _oldest(self, table):
+        with self.lock:
+            row = self.db.execute("SELECT MIN(id) FROM spool WHERE tbl = ?", (table,)).fetchone()
+        return row[0] or 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "path": self.path,
+                "bytes": self.bytes,
+                "max_bytes": self.max_bytes,
+                "tables": dict(self.pending),
+                **self.counters
+            }
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+def open_spool(path):
+    if not path:
+        return None
+    try:
+        return WriteSpool(path)
+    except sqlite3.Error as exc:
+        print(f"[ERROR] Spool {path}: {exc}; failed writes will be dropped")
+        return None
+
+SPOOL = open_spool(SPOOL_PATH) if STORAGE_BACKEND == "supabase" else None  # replays go over REST
+
+def spool_rows(table, rows):
+    # Write-behind overflow: rows the queue had no room for are spooled instead of dropped
+    if SPOOL is None or UPSERT_KEYS.get(table):
+        return 0
+    spooled = 0
+    for chunk in chunk_rows(rows):
+        if SPOOL.append(table, "[" + ",".join(chunk) + "]", len(chunk)):
+            spooled += len(chunk)
+    return spooled
+
+# ----------------- STORAGE BACKENDS -----------------
+# Every backend takes PostgREST-style filters ({"col": "op.value"}, "in.(a,b)", "and=(col.op.value,...)"),
+# so callers stay the same whichever sink is configured.
+POSTGREST_OPS = {"eq": "=", "neq": "<>", "lt": "<", "lte": "<=", "gt": ">", "gte": ">="}
+PY_OPS = {"eq": operator.eq, "neq": operator.ne, "lt": operator.lt, "lte": operator.le, "gt": operator.gt, "gte": operator.ge}
+SELECT_PARAMS = ("select", "order", "limit")
+
+def parse_filters(filters):
+    # -> [(column, op, value)], value a list for "in"
+    conditions = []
+    for column, expr in filters.items():
+        if column in SELECT_PARAMS:
+            continue
+        if column == "and":
+            for part in expr.strip("()").split(","):
+                col, op, value = part.split(".", 2)
+                conditions.append((col, op, value))
+            continue
+        op, value = expr.split(".", 1)
+        if op == "in":
+            value = value.strip("()").split(",")
+        elif op not in POSTGREST_OPS:
+            raise ValueError(f"Unsupported filter {column}={expr}")
+        conditions.append((column, op, value))
+    return conditions
+
+def parse_order(order):
+    # "col.asc,col2.desc" -> [(col, descending)]
+    return [(part.split(".")[0], part.endswith(".desc")) for part in order.split(",")] if order else []
+
+def quote_ident(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def row_columns(rows):
+    # Union of keys in first-seen order; rows may omit optional columns such as station_id
+    return list(dict.fromkeys(k for row in rows for k in row))
+
+def row_matcher(conditions):
+    # Python predicate for backends without a query engine
+    def match(row):
+        for col, op, value in conditions:
+            v = row.get(col)
+            if v is None:
+                return False
+            cast = float if isinstance(v, (int, float)) else str
+            if op == "in":
+                if str(v) not in value:
+                    return False
+            elif not PY_OPS[op](v if cast is float else str(v), cast(value)):
+                return False
+        return True
+    return match
+
+class StorageBackend:
+    name = "base"
+
+    def insert_many(self, table, rows, on_conflict=None):
+        # Returns rows accepted; on_conflict names the key columns to merge on
+        raise NotImplementedError
+
+    def delete_where(self, table, filters):
+        # Returns True on success
+        raise NotImplementedError
+
+    def select(self, table, params):
+        # Rows as dicts, or None on failure
+        raise NotImplementedError
+
+    def delete(self, table, column, value):
+        return self.delete_where(table, {column: f"eq.{value}"})
+
+    def write(self, table, rows):
+        # Write-behind writer: upserts tables listed in UPSERT_KEYS, appends everything else
+        return self.insert_many(table, rows, on_conflict=UPSERT_KEYS.get(table))
+
+    def close(self):
+        pass
+
+class SupabaseStorage(StorageBackend):
+    # PostgREST over HTTP, with the durable spool behind it
+    name = "supabase"
+
+    def insert_many(self, table, rows, on_conflict=None):
+        return supabase_insert_many(table, rows, on_conflict=on_conflict)
+
+    def delete_where(self, table, filters):
+        return supabase_delete_where(table, filters)
+
+    def select(self, table, params):
+        return supabase_select(table, params)
+
+    def close(self):
+        SUPABASE.close()
+
+class SQLStorage(StorageBackend):
+    # Filters, selects and deletes shared by the SQL backends
+    placeholder = "?"
+    errors = (sqlite3.Error,)
+
+    def where(self, filters):
+        clauses, params = [], []
+        for col, op, value in parse_filters(filters):
+            if op == "in":
+                clauses.append(f"{quote_ident(col)} IN ({', '.join([self.placeholder] * len(value))})")
+                params.extend(value)
+            else:
+                clauses.append(f"{quote_ident(col)} {POSTGREST_OPS[op]} {self.placeholder}")
+                params.append(value)
+        return " AND ".join(clauses) or "1=1", params
+
+    def delete_where(self, table, filters):
+        clause, params = self.where(filters)
+        try:
+            self.execute(f"DELETE FROM {quote_ident(table)} WHERE {clause}", params)
+        except self.errors as exc:
+            print(f"[ERROR] Delete {table}: {exc}")
+            return False
+        return True
+
+    def select(self, table, params):
+        columns = params.get("select", "*")
+        if columns != "*":
+            columns = ", ".join(quote_ident(c) for c in columns.split(","))
+        clause, values = self.where(params)
+        sql = f"SELECT {columns} FROM {quote_ident(table)} WHERE {clause}"
+        order = parse_order(params.get("order"))
+        if order:
+            sql += " ORDER BY " + ", ".join(f"{quote_ident(c)} {'DESC' if desc else 'ASC'}" for c, desc in order)
+        if params.get("limit"):
+            sql += f" LIMIT {int(params['limit'])}"
+        try:
+            return self.query(sql, values)
+        except self.errors as exc:
+            print(f"[ERROR] Select {table}: {exc}")
+            return None
+
+    def upsert_sql(self, table, source, columns, on_conflict):
+        # INSERT ... ON CONFLICT DO UPDATE, valid for both SQLite (>= 3.24) and Postgres
+        keys = [c.strip() for c in on_conflict.split(",")]
+        cols = ", ".join(quote_ident(c) for c in columns)
+        updates = ", ".join(f"{quote_ident(c)} = excluded.{quote_ident(c)}" for c in columns if c not in keys)
+        action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+        return (f"INSERT INTO {quote_ident(table)} ({cols}) {source} "
+                f"ON CONFLICT ({', '.join(quote_ident(k) for k in keys)}) {action}")
+
+class SQLiteStorage(SQLStorage):
+    # Local file (or ":memory:") database; tables and columns are created on first write
+    name = "sqlite"
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        if path != ":memory:":
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.columns = {}  # table -> known columns
+
+    def execute(self, sql, params=()):
+        with self.lock, self.db:
+            try:
+                self.db.execute(sql, params)
+            except sqlite3.OperationalError as exc:
+                if "no such table" not in str(exc):  # nothing written yet, so nothing to delete
+                    raise
+
+    def query(self, sql, params=()):
+        with self.lock:
+            try:
+                return [dict(row) for row in self.db.execute(sql, params)]
+            except sqlite3.OperationalError as exc:
+                if "no such table" in str(exc):
+                    return []
+                raise
+
+    def _ensure(self, table, columns, on_conflict):
+        known = self.columns.get(table)
+        if known is None:
+            known = {row[1] for row in self.db.execute(f"PRAGMA table_info({quote_ident(table)})")}
+            if not known:
+                self.db.execute(f"CREATE TABLE {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)})")
+                known = set(columns)
+            self.columns[table] = known
+        for c in columns:
+            if c not in known:
+                self.db.execute(f"ALTER TABLE {quote_ident(table)} ADD COLUMN {quote_ident(c)}")
+                known.add(c)
+        if on_conflict:
+            keys = [k.strip() for k in on_conflict.split(",")]
+            index = quote_ident(f"{table}_{'_'.join(keys)}_key")
+            self.db.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS {index} ON {quote_ident(table)} "
+                            f"({', '.join(quote_ident(k) for k in keys)})")
+
+    def insert_many(self, table, rows, on_conflict=None):
+        if not rows:
+            return 0
+        columns = row_columns(rows)
+        values = f"VALUES ({', '.join('?' * len(columns))})"
+        if on_conflict:
+            sql = self.upsert_sql(table, values, columns, on_conflict)
+        else:
+            sql = f"INSERT INTO {quote_ident(table)} ({', '.join(quote_ident(c) for c in columns)}) {values}"
+        try:
+            with self.lock, self.db:
+                self._ensure(table, columns, on_conflict)
+                self.db.executemany(sql, [[row.get(c) for c in columns] for row in rows])
+        except sqlite3.Error as exc:
+            print(f"[ERROR] Insert {table} ({len(rows)} rows): {exc}")
+            return 0
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+class PostgresStorage(SQLStorage):
+    # Direct connection; bulk loads stream through COPY, upserts through a COPY-filled temp table
+    name = "postgres"
+    placeholder = "%s"
+
+    def __init__(self, dsn):
+        import psycopg
+        from psycopg.rows import dict_row
+        self.psycopg = psycopg
+        self.errors = (psycopg.Error,)
+        self.dsn = dsn
+        self.row_factory = dict_row
+        self.lock = threading.Lock()
+        self.conn = None
+
+    def _connection(self):
+        if self.conn is None or self.conn.closed:
+            self.conn = self.psycopg.connect(self.dsn, autocommit=True)
+        return self.conn
+
+    def execute(self, sql, params=()):
+        with self.lock:
+            self._connection().execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self.lock:
+            with self._connection().cursor(row_factory=self.row_factory) as cur:
+                return cur.execute(sql, params).fetchall()
+
+    def insert_many(self, table, rows, on_conflict=None):
+        if not rows:
+            return 0
+        columns = row_columns(rows)
+        cols = ", ".join(quote_ident(c) for c in columns)
+        try:
+            with self.lock:
+                conn = self._connection()
+                with conn.transaction(), conn.cursor() as cur:
+                    target = quote_ident(table)
+                    if on_conflict:
+                        target = quote_ident(f"_load_{table}")
+                        cur.execute(f"CREATE TEMP TABLE {target} (LIKE {quote_ident(table)} INCLUDING DEFAULTS) ON COMMIT DROP")
+                    with cur.copy(f"COPY {target} ({cols}) FROM STDIN") as copy:
+                        for row in rows:
+                            copy.write_row([row.get(c) for c in columns])
+                    if on_conflict:
+                        cur.execute(self.upsert_sql(table, f"SELECT {cols} FROM {target}", columns, on_conflict))
+        except self.psycopg.Error as exc:
+            print(f"[ERROR] Insert {table} ({len(rows)} rows): {exc}")
+            return 0
+        return len(rows)
+
+    def close(self):
+        with self.lock:
+            if self.conn is not None:
+                self.conn.close()
+
+class ParquetStorage(StorageBackend):
+    # Append-only part files per table (<path>/<table>/part-*.parquet); deletes rewrite only the files they touch.
+    # Upserts are appended like inserts: Parquet has no keys to merge on.
+    name = "parquet"
+
+    def __init__(self, path):
+        import pyarrow
+        import pyarrow.parquet
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.lock = threading.Lock()
+        self.seq = 0
+
+    def _files(self, table):
+        return sorted(glob.glob(os.path.join(self.path, table, "part-*.parquet")))
+
+    def _write(self, path, rows):
+        columns = row_columns(rows)
+        data = self.pa.table({c: [row.get(c) for row in rows] for c in columns})
+        tmp = path + ".tmp"
+        self.pq.write_table(data, tmp)
+        os.replace(tmp, path)
+
+    def insert_many(self, table, rows, on_conflict=None):
+        if not rows:
+            return 0
+        try:
+            with self.lock:
+                os.makedirs(os.path.join(self.path, table), exist_ok=True)
+                self.seq += 1
+                self._write(os.path.join(self.path, table, f"part-{time.time_ns()}-{self.seq:06d}.parquet"), rows)
+        except (OSError, self.pa.ArrowException) as exc:
+            print(f"[ERROR] Insert {table} ({len(rows)} rows): {exc}")
+            return 0
+        return len(rows)
+
+    def delete_where(self, table, filters):
+        match = row_matcher(parse_filters(filters))
+        try:
+            with self.lock:
+                for path in self._files(table):
+                    rows = self.pq.read_table(path).to_pylist()
+                    keep = [row for row in rows if not match(row)]
+                    if len(keep) == len(rows):
+                        continue
+                    if keep:
+                        self._write(path, keep)
+                    else:
+                        os.remove(path)
+        except (OSError, self.pa.ArrowException) as exc:
+            print(f"[ERROR] Delete {table}: {exc}")
+            return False
+        return True
+
+    def select(self, table, params):
+        match = row_matcher(parse_filters(params))
+        try:
+            with self.lock:
+                rows = [row for path in self._files(table) for row in self.pq.read_table(path).to_pylist() if match(row)]
+        except (OSError, self.pa.ArrowException) as exc:
+            print(f"[ERROR] Select {table}: {exc}")
+            return None
+        for col, desc in reversed(parse_order(params.get("order"))):
+            rows.sort(key=lambda row: (row.get(col) is None, row.get(col)), reverse=desc)
+        if params.get("limit"):
+            rows = rows[:int(params["limit"])]
+        if params.get("select", "*") != "*":
+            columns = params["select"].split(",")
+            rows = [{c: row.get(c) for c in columns} for row in rows]
+        return rows
+
+def open_storage(kind):
+    try:
+        if kind == "supabase":
+            return SupabaseStorage()
+        if kind == "postgres":
+            return PostgresStorage(STORAGE_DSN)
+        if kind == "sqlite":
+            return SQLiteStorage(STORAGE_PATH or "satellites.db")
+        if kind == "parquet":
+            if UPSERT_KEYS:
+                # appended upserts would grow satellite_state without bound again
+                raise ValueError("STORAGE_BACKEND=parquet cannot merge upserts; use STATE_MODE=append")
+            return ParquetStorage(STORAGE_PATH or "data")
+    except ImportError as exc:
+        raise RuntimeError(f"STORAGE_BACKEND={kind} needs {exc.name}: pip install -r requirements-storage.txt") from exc
+    raise ValueError(f"Unknown STORAGE_BACKEND {kind!r}")
+
+STORAGE = open_storage(STORAGE_BACKEND)
+
+# ----------------- WRITE-BEHIND QUEUE -----------------
+# Tables whose pending rows are coalesced by key: only the newest row per key is written
+COALESCE_KEYS = {"satellite_state": "satellite_id"}
+
+class WriteBehindQueue:
+    def __init__(self, writer, max_rows=None, flush_rows=None, flush_age=None,
+                 put_timeout=None, coalesce=None, overflow=None):
+        self.writer = writer
+        self.overflow = overflow  # called with (table, rows) for rows dropped on a full queue; returns rows kept
+        self.max_rows = max_rows or WRITE_QUEUE_MAX_ROWS
+        self.flush_rows = flush_rows or WRITE_QUEUE_FLUSH_ROWS
+        self.flush_age = WRITE_QUEUE_FLUSH_AGE if flush_age is None else flush_age
+        self.put_timeout = WRITE_QUEUE_PUT_TIMEOUT if put_timeout is None else put_timeout
+        self.coalesce = COALESCE_KEYS if coalesce is None else coalesce
+        self.cond = threading.Condition()
+        self.pending = {}  # table -> list of rows, or {key: row} for coalesced tables
+        self.oldest = {}  # table -> monotonic time the oldest pending row was queued
+        self.depth = 0
+        self.counters = {"enqueued": 0, "coalesced": 0, "dropped": 0, "overflowed": 0, "flushed": 0, "failed": 0}
+        self.last_flush_sec = 0.0
+        self.running = False
+        self.thread = None
+
+    def start(self):
+        with self.cond:
+            if self.running:
+                return
+            self.running = True
+        self.thread = threading.Thread(target=self._run, name="write-behind", daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=30):
+        with self.cond:
+            self.running = False
+            self.cond.notify_all()
+        if self.thread:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def put(self, table, rows):
+        key = self.coalesce.get(table)
+        dropped = []
+        deadline = time.monotonic() + self.put_timeout  # one wait budget for the whole call, not per row
+        with self.cond:
+            for i, row in enumerate(rows):
+                buf = self.pending.get(table)
+                if key and buf and row[key] in buf:
+                    buf[row[key]] = row
+                    self.counters["coalesced"] += 1
+                    continue
+                if self.depth >= self.max_rows and not self.cond.wait_for(
+                        lambda: self.depth < self.max_rows, max(deadline - time.monotonic(), 0)):
+                    dropped = list(rows[i:])
+                    break
+                buf = self.pending.get(table)
+                if buf is None:
+                    buf = self.pending[table] = {} if key else []
+                    self.oldest[table] = time.monotonic()
+                if key:
+                    if row[key] in buf:
+                        # another producer queued this key while we waited for space
+                        buf[row[key]] = row
+                        self.counters["coalesced"] += 1
+                        continue
+                    buf[row[key]] = row
+                else:
+                    buf.append(row)
+                self.depth += 1
+                self.counters["enqueued"] += 1
+            # the table's queued rows go with the overflow so it stays in order
+            if dropped and self.overflow and table in self.pending:
+                dropped = self._take(table) + dropped
+            self.cond.notify_all()
+        if dropped:
+            kept = self.overflow(table, dropped) if self.overflow else 0
+            with self.cond:
+                self.counters["overflowed"] += kept
+                self.counters["dropped"] += len(dropped) - kept
+
+    def stats(self):
+        with self.cond:
+            now = time.monotonic()
+            return {
+                "depth": self.depth,
+                "max_rows": self.max_rows,
+                "tables": {t: len(buf) for t, buf in self.pending.items()},
+                "lag_sec": max((now - t0 for t0 in self.oldest.values()), default=0.0),
+                "last_flush_sec": self.last_flush_sec,
+                **self.counters
+            }
+
+    def _take(self, table):
+        buf = self.pending.pop(table)
+        self.oldest.pop(table, None)
+        rows = list(buf.values()) if isinstance(buf, dict) else buf
+        self.depth -= len(rows)
+        self.cond.notify_all()
+        return rows
+
+    def _due(self, now):
+        if not self.running:
+            return list(self.pending)
+        return [t for t, buf in self.pending.items()
+                if len(buf) >= self.flush_rows or now - self.oldest[t] >= self.flush_age]
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while True:
+                    now = time.monotonic()
+                    due = self._due(now)
+                    if due or not self.running:
+                        break
+                    waits = [self.oldest[t] + self.flush_age - now for t in self.pending]
+                    self.cond.wait(max(min(waits), 0) if waits else None)
+                batches = [(t, self._take(t)) for t in due]
+            if not batches:
+                return
+            for table, rows in batches:
+                self._write(table, rows)
+
+    def _write(self, table, rows):
+        t0 = time.monotonic()
+        try:
+            written = self.writer(table, rows)
+        except Exception as exc:
+            print(f"[ERROR] Write-behind flush {table} ({len(rows)} rows): {exc}")
+            written = 0
+        with self.cond:
+            self.last_flush_sec = time.monotonic() - t0
+            self.counters["flushed"] += written
+            self.counters["failed"] += len(rows) - written
+
+WRITE_QUEUE = WriteBehindQueue(STORAGE.write, overflow=spool_rows)
+
+# ----------------- MATH HELPERS -----------------
 def elevation_angle(r):
-    x, y, z = r
-    xg = (EARTH_RADIUS + GS_ALT) * math.cos(GS_LAT) * math.cos(GS_LON)
-    yg = (EARTH_RADIUS + GS_ALT) * math.cos(GS_LAT) * math.sin(GS_LON)
-    zg = (EARTH_RADIUS + GS_ALT) * math.sin(GS_LAT)
-    rx, ry, rz = x - xg, y - yg, z - zg
-    range_norm = math.sqrt(rx*rx + ry*ry + rz*rz)
-    dot = rx*xg + ry*yg + rz*zg
-    elev = math.asin(dot / (range_norm * EARTH_RADIUS))
-    return math.degrees(elev)
+    return DEFAULT_STATION.elevation(r)
+
+# ----------------- FRAMES -----------------
+# SGP4 outputs TEME positions; ground tracks and look angles need Earth-fixed ones
+EARTH_ROTATION = 7.292115146706979e-5  # rad/s
+
+def gmst(jd, fr):
+    # IAU-82 Greenwich mean sidereal time in radians, evaluated once for a whole time grid
+    jd, fr = np.asarray(jd, dtype=float), np.asarray(fr, dtype=float)
+    tut1 = (jd - 2451545.0 + fr) / 36525.0
+    seconds = (-6.2e-6 * tut1 ** 3 + 0.093104 * tut1 ** 2
+               + (876600.0 * 3600 + 8640184.812866) * tut1 + 67310.54841)
+    return np.radians(seconds / 240.0) % (2 * np.pi)
+
+def teme_to_ecef(r, jd=None, fr=None, v=None, theta=None):
+    # r, v: (..., n, 3) or (3,) TEME vectors for times (n,) or a scalar time.
+    # Pass theta from gmst() to reuse one sidereal-angle grid across satellites.
+    # Returns ECEF position, plus ECEF velocity when v is given (polar motion ignored)
+    theta = gmst(jd, fr) if theta is None else theta
+    c, s = np.cos(theta), np.sin(theta)
+    r = np.asarray(r, dtype=float)
+    x, y = r[..., 0], r[..., 1]
+    r_ecef = np.stack([c * x + s * y, -s * x + c * y, r[..., 2]], axis=-1)
+    if v is None:
+        return r_ecef
+    v = np.asarray(v, dtype=float)
+    vx, vy = v[..., 0], v[..., 1]
+    v_ecef = np.stack([c * vx + s * vy + EARTH_ROTATION * r_ecef[..., 1],
+                       -s * vx + c * vy - EARTH_ROTATION * r_ecef[..., 0],
+                       v[..., 2]], axis=-1)
+    return r_ecef, v_ecef
+
+# ----------------- TIME GRIDS -----------------
+def jday_datetime(t):
+    # Like jday, but keeps sub-second precision
+    return jday(t.year, t.month, t.day, t.hour, t.minute, t.second + t.microsecond / 1e6)
+
+class TimeGrid:
+    # Float (jd, fr) arrays for start + offsets, shared by every satellite propagated on it
+    def __init__(self, start, offsets):
+        self.start = start
+        self.offsets = np.asarray(offsets, dtype=float)
+        jd0, fr0 = jday_datetime(start)
+        fr = fr0 + self.offsets / 86400.0
+        whole = np.floor(fr)
+        self.jd = jd0 + whole
+        self.fr = fr - whole
+        self._theta = None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    @property
+    def theta(self):
+        # GMST for every grid point, computed on first use
+        if self._theta is None:
+            self._theta = gmst(self.jd, self.fr)
+        return self._theta
+
+    def time(self, i):
+        return self.start + timedelta(seconds=float(self.offsets[i]))
+
+    def iso(self, i):
+        # Formatted on demand, only for rows that are actually emitted
+        return self.time(i).isoformat()
+
+@lru_cache(maxsize=64)
+def time_grid(start, step, count):
+    return TimeGrid(start, np.arange(count) * step)
+
+def eci_to_latlon_array(r):
+    # r: (n, 3) positions in km -> lat/lon in degrees, alt in km, each shape (n,)
+    x, y, z = r[:, 0], r[:, 1], r[:, 2]
+    rho = np.hypot(x, y)
+    lon = np.arctan2(y, x)
+    lat = np.arctan2(z, rho)
+    alt = np.sqrt(rho * rho + z * z) - EARTH_RADIUS
+    return np.degrees(lat), np.degrees(lon), alt
+
+# ----------------- GROUND STATIONS -----------------
+class GroundStation:
+    # WGS84 ECEF position and ENU rotation are computed once; look angles reuse them
+    def __init__(self, id, name, lat, lon, alt=0.0, min_elevation=None):
+        self.id = id
+        self.name = name
+        self.lat = float(lat)  # degrees
+        self.lon = float(lon)  # degrees
+        self.alt = float(alt)  # meters
+        self.min_elevation = MIN_ELEV if min_elevation is None else float(min_elevation)
+        lat_r, lon_r = math.radians(self.lat), math.radians(self.lon)
+        sin_lat, cos_lat = math.sin(lat_r), math.cos(lat_r)
+        sin_lon, cos_lon = math.sin(lon_r), math.cos(lon_r)
+        h = self.alt / 1000.0
+        n = EARTH_RADIUS / math.sqrt(1 - WGS84_E2 * sin_lat * sin_lat)
+        self.ecef = np.array([(n + h) * cos_lat * cos_lon,
+                              (n + h) * cos_lat * sin_lon,
+                              (n * (1 - WGS84_E2) + h) * sin_lat])  # km
+        self.enu = np.array([[-sin_lon, cos_lon, 0.0],
+                             [-sin_lat * cos_lon, -sin_lat * sin_lon, cos_lat],
+                             [cos_lat * cos_lon, cos_lat * sin_lon, sin_lat]])  # rows: east, north, up
+        self.up = self.enu[2]
+        self._ecef = tuple(self.ecef.tolist())
+        self._up = tuple(self.up.tolist())
+
+    def elevation(self, r):
+        # Scalar fast path for one position, in degrees
+        dx, dy, dz = r[0] - self._ecef[0], r[1] - self._ecef[1], r[2] - self._ecef[2]
+        ux, uy, uz = self._up
+        return math.degrees(math.asin((dx * ux + dy * uy + dz * uz) / math.sqrt(dx * dx + dy * dy + dz * dz)))
+
+    def look_angles(self, r, v=None):
+        # r, v: (n, 3) positions (km) and velocities (km/s) in the station's Earth-fixed frame.
+        # Returns azimuth and elevation in degrees, range in km and range rate in km/s (None without v)
+        d = np.asarray(r) - self.ecef
+        enu = d @ self.enu.T
+        rng = np.linalg.norm(d, axis=-1)
+        az = np.degrees(np.arctan2(enu[..., 0], enu[..., 1])) % 360.0
+        el = np.degrees(np.arcsin(np.clip(enu[..., 2] / rng, -1.0, 1.0)))
+        rate = np.einsum("...k,...k->...", d, np.asarray(v)) / rng if v is not None else None
+        return az, el, rng, rate
+
+DEFAULT_STATION = GroundStation(GS_ID, "Default", math.degrees(GS_LAT), math.degrees(GS_LON), GS_ALT, MIN_ELEV)
+
+def load_ground_stations(path=None):
+    path = path or GROUND_STATIONS_FILE
+    if not path:
+        return {DEFAULT_STATION.id: DEFAULT_STATION}
+    with open(path) as f:
+        return {gs["id"]: GroundStation(**gs) for gs in json.load(f)}
+
+GROUND_STATIONS = load_ground_stations()
+
+def elevation_matrix(r, stations):
+    # r: (n, 3) positions -> (len(stations), n) elevations in degrees, one matrix product for all stations
+    positions = np.stack([gs.ecef for gs in stations])  # (s, 3)
+    ups = np.stack([gs.up for gs in stations])  # (s, 3)
+    d = r[None, :, :] - positions[:, None, :]  # (s, n, 3)
+    dist = np.linalg.norm(d, axis=2)
+    sin_el = np.einsum("snk,sk->sn", d, ups) / dist
+    return np.degrees(np.arcsin(np.clip(sin_el, -1.0, 1.0)))
+
+# ----------------- BATCH PROPAGATION -----------------
+class CatalogPropagator:
+    # Propagates the whole catalog in a single SatrecArray.sgp4 call per tick
+    def __init__(self, instances):
+        self.ids = [s["id"] for s in instances]
+        self.by_id = {s["id"]: s for s in instances}
+        self.array = SatrecArray([s["sat"] for s in instances]) if instances else None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def propagate(self, jd, fr):
+        # Returns error codes (n,), positions (n, 3) and velocities (n, 3) at one instant
+        if self.array is None:
+            return np.zeros(0, dtype=np.uint8), np.zeros((0, 3)), np.zeros((0, 3))
+        e, r, v = self.array.sgp4(np.array([jd]), np.array([fr]))
+        return e[:, 0], r[:, 0, :], v[:, 0, :]
+
+    def states_at(self, t):
+        jd, fr = jday_datetime(t)
+        e, r, v = self.propagate(jd, fr)
+        ok = e == 0
+        lat, lon, alt = eci_to_latlon_array(teme_to_ecef(r[ok], jd, fr))
+        speed = np.linalg.norm(v[ok], axis=1)
+        ids = [sid for sid, good in zip(self.ids, ok) if good]
+        return ids, lat, lon, alt, speed
+
+PROPAGATOR = CatalogPropagator(SAT_INSTANCES)
+
+# ----------------- EPHEMERIS CACHE -----------------
+class EphemerisCache:
+    # Piecewise Chebyshev fits of SGP4 TEME position and velocity over fixed time segments.
+    # Each fit is checked against SGP4 between its nodes; segments that miss the tolerance
+    # (or hit SGP4 errors) are marked exact and answered by SGP4 directly.
+    SEGMENT_OVERHEAD = 256  # bytes of bookkeeping per cached segment
+
+    def __init__(self, segment=None, degree=None, tol_km=None, tol_kms=None, budget_mb=None):
+        self.segment = segment or EPHEMERIS_SEGMENT
+        self.degree = degree or EPHEMERIS_DEGREE
+        self.tol_km = EPHEMERIS_TOL_KM if tol_km is None else tol_km
+        self.tol_kms = EPHEMERIS_TOL_KMS if tol_kms is None else tol_kms
+        self.budget = int((EPHEMERIS_CACHE_MB if budget_mb is None else budget_mb) * 1024 * 1024)
+        n = self.degree + 1
+        self.nodes = np.cos(np.pi * (np.arange(n) + 0.5) / n)
+        ordered = np.sort(self.nodes)
+        self.checks = np.concatenate(([-1.0, 1.0], (ordered[:-1] + ordered[1:]) / 2))
+        self.segments = OrderedDict()  # (sat_id, elements_hash, index) -> (coef_r, coef_v, error_km) or None
+        self.bytes = 0
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0, "exact": 0}
+        self.max_error_km = 0.0
+
+    def _fit(self, sat_obj, index):
+        t0 = datetime.fromtimestamp(index * self.segment, timezone.utc)
+        x = np.concatenate((self.nodes, self.checks))
+        grid = TimeGrid(t0, (x + 1) * self.segment / 2)
+        e, r, v = sat_obj.sgp4_array(grid.jd, grid.fr)
+        if np.any(e != 0):
+            return None
+        n = len(self.nodes)
+        coef_r = chebyshev.chebfit(self.nodes, r[:n], self.degree)
+        coef_v = chebyshev.chebfit(self.nodes, v[:n], self.degree)
+        err_r = float(np.abs(chebyshev.chebval(self.checks, coef_r).T - r[n:]).max())
+        err_v = float(np.abs(chebyshev.chebval(self.checks, coef_v).T - v[n:]).max())
+        if err_r > self.tol_km or err_v > self.tol_kms:
+            return None
+        return coef_r, coef_v, err_r
+
+    def _segment(self, entry, index):
+        key = (entry["id"], entry.get("elements_hash"), int(index))
+        with self.lock:
+            if key in self.segments:
+                self.segments.move_to_end(key)
+                self.counters["hits"] += 1
+                return self.segments[key]
+            self.counters["misses"] += 1
+        fit = self._fit(entry["sat"], index)
+        size = self.SEGMENT_OVERHEAD + (fit[0].nbytes + fit[1].nbytes if fit else 0)
+        with self.lock:
+            if key not in self.segments:
+                self.segments[key] = fit
+                self.bytes += size
+                if fit is None:
+                    self.counters["exact"] += 1
+                else:
+                    self.max_error_km = max(self.max_error_km, fit[2])
+            while self.bytes > self.budget and len(self.segments) > 1:
+                _, old = self.segments.popitem(last=False)
+                self.bytes -= self.SEGMENT_OVERHEAD + (old[0].nbytes + old[1].nbytes if old else 0)
+                self.counters["evictions"] += 1
+        return fit
+
+    def states(self, entry, unix_times):
+        # TEME positions (n, 3) and velocities (n, 3) at arbitrary Unix times; NaN where SGP4 fails
+        t = np.atleast_1d(np.asarray(unix_times, dtype=float))
+        index = np.floor(t / self.segment).astype(np.int64)
+        r = np.empty((len(t), 3))
+        v = np.empty((len(t), 3))
+        for i in np.unique(index):
+            mask = index == i
+            fit = self._segment(entry, i)
+            if fit is None:
+                start = datetime.fromtimestamp(float(t[mask][0]), timezone.utc)
+                grid = TimeGrid(start, t[mask] - t[mask][0])
+                e, r[mask], v[mask] = entry["sat"].sgp4_array(grid.jd, grid.fr)
+                continue
+            x = 2 * (t[mask] - i * self.segment) / self.segment - 1
+            r[mask] = chebyshev.chebval(x, fit[0]).T
+            v[mask] = chebyshev.chebval(x, fit[1]).T
+        return r, v
+
+    def invalidate(self, sat_id):
+        with self.lock:
+            for key in [k for k in self.segments if k[0] == sat_id]:
+                old = self.segments.pop(key)
+                self.bytes -= self.SEGMENT_OVERHEAD + (old[0].nbytes + old[1].nbytes if old else 0)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "segments": len(self.segments),
+                "bytes": self.bytes,
+                "budget_bytes": self.budget,
+                "max_fit_error_km": self.max_error_km,
+                **self.counters
+            }
+
+EPHEMERIS = EphemerisCache()
+
+# ----------------- POSITION QUERIES -----------------
+class PositionCache:
+    # LRU of computed positions keyed by quantized Unix time; misses are evaluated together from the ephemeris cache
+    def __init__(self, quantum=None, size=None):
+        self.quantum = quantum or POSITION_QUANTUM
+        self.size = size or POSITION_CACHE_SIZE
+        self.rows = OrderedDict()  # (sat_id, elements_hash, quantized ts) -> row
+        self.lock = threading.Lock()
+        self.counters = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def quantize(self, unix_times):
+        return np.round(np.asarray(unix_times, dtype=float) / self.quantum) * self.quantum
+
+    def _compute(self, entry, times):
+        t = np.asarray(times, dtype=float)
+        grid = TimeGrid(datetime.fromtimestamp(t[0], timezone.utc), t - t[0])
+        r, v = EPHEMERIS.states(entry, t)
+        ok = np.isfinite(r).all(axis=1)  # NaN where SGP4 failed
+        lat, lon, alt = eci_to_latlon_array(teme_to_ecef(np.nan_to_num(r), theta=grid.theta))
+        speed = np.linalg.norm(v, axis=1)
+        rows = []
+        for i, good in enumerate(ok.tolist()):
+            row = {"timestamp": grid.iso(i)}
+            if not good:
+                row["error"] = "propagation failed"
+            else:
+                row.update(latitude=float(lat[i]), longitude=float(lon[i]),
+                           altitude_km=float(alt[i]), velocity_kms=float(speed[i]))
+            rows.append(row)
+        return rows
+
+    def positions(self, entry, unix_times):
+        # One row per requested time, in request order
+        times = self.quantize(unix_times).tolist()
+        prefix = (entry["id"], entry.get("elements_hash"))
+        found, missing = {}, []
+        with self.lock:
+            for t in set(times):
+                key = prefix + (t,)
+                if key in self.rows:
+                    self.rows.move_to_end(key)
+                    found[t] = self.rows[key]
+                else:
+                    missing.append(t)
+            self.counters["hits"] += len(found)
+            self.counters["misses"] += len(missing)
+        if missing:
+            missing.sort()
+            computed = dict(zip(missing, self._compute(entry, missing)))
+            found.update(computed)
+            with self.lock:
+                for t, row in computed.items():
+                    self.rows[prefix + (t,)] = row
+                while len(self.rows) > self.size:
+                    self.rows.popitem(last=False)
+                    self.counters["evictions"] += 1
+        return [found[t] for t in times]
+
+    def invalidate(self, sat_id):
+        with self.lock:
+            for key in [k for k in self.rows if k[0] == sat_id]:
+                del self.rows[key]
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.rows), "quantum_s": self.quantum, **self.counters}
+
+POSITION_CACHE = PositionCache()
+
+def parse_time(value):
+    # ISO 8601 (naive means UTC) or Unix seconds -> Unix seconds; ValueError for anything unrepresentable
+    try:
+        ts = float(value)
+    except ValueError:
+        t = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+        if t.tzinfo is None:
+            t = t.replace(tzinfo=timezone.utc)
+        return t.timestamp()
+    if not math.isfinite(ts):
+        raise ValueError(f"{value!r} is not a finite time")
+    try:
+        datetime.fromtimestamp(ts, timezone.utc)
+    except (OverflowError, OSError) as exc:
+        raise ValueError(f"{value!r} is out of range") from exc
+    return ts
+
+# ----------------- ORBIT PATH WINDOW -----------------
+class OrbitPathWindow:
+    # Rolling future path for one satellite, kept as a ring buffer on a fixed time grid
+    def __init__(self, sat_obj, sat_id, minutes=None, step=None):
+        self.sat_obj = sat_obj
+        self.sat_id = sat_id
+        entry = PROPAGATOR.by_id.get(sat_id)
+        # share ephemeris segments with position queries when this is the current catalog entry
+        self.entry = entry if entry and entry["sat"] is sat_obj else {"id": sat_id, "sat": sat_obj}
+        self.step = step or ORBIT_PATH_STEP
+        self.span = (minutes or ORBIT_PATH_MINUTES) * 60
+        self.points = deque(maxlen=math.ceil(self.span / self.step))  # (unix ts, row)
+        self.next_ts = None
+
+    def advance(self, now=None):
+        # Drops points before the current grid slot and computes the newly needed future ones.
+        # Returns (cutoff for expired rows or None, new rows)
+        now_ts = (now or datetime.now(timezone.utc)).timestamp()
+        start = math.floor(now_ts / self.step) * self.step
+        cutoff = None
+        while self.points and self.points[0][0] < start:
+            self.points.popleft()
+            cutoff = datetime.fromtimestamp(start, timezone.utc)
+        if self.next_ts is None or self.next_ts < start:
+            self.next_ts = start
+        count = math.ceil((start + self.span - self.next_ts) / self.step)
+        if count <= 0:
+            return cutoff, []
+        # windows on the same step are aligned, so every satellite shares this grid
+        grid = time_grid(datetime.fromtimestamp(self.next_ts, timezone.utc), self.step, count)
+        r, _ = EPHEMERIS.states(self.entry, self.next_ts + grid.offsets)
+        ok = np.flatnonzero(np.isfinite(r).all(axis=1))
+        lat, lon, alt = eci_to_latlon_array(teme_to_ecef(r[ok], theta=grid.theta[ok]))
+        rows = []
+        for n, i in enumerate(ok):
+            row = {
+                "satellite_id": self.sat_id,
+                "latitude": float(lat[n]),
+                "longitude": float(lon[n]),
+                "altitude_km": float(alt[n]),
+                "timestamp": grid.iso(i)
+            }
+            self.points.append((self.next_ts + float(grid.offsets[i]), row))
+            rows.append(row)
+        self.next_ts += count * self.step
+        return cutoff, rows
+
+    def path(self):
+        return [row for _, row in self.points]
+
+ORBIT_WINDOWS = {}  # sat_id -> OrbitPathWindow
+
+def refresh_orbit_paths():
+    now = datetime.now(timezone.utc)
+    rows, expired = [], {}
+    for window in list(ORBIT_WINDOWS.values()):
+        cutoff, new_rows = window.advance(now)
+        rows.extend(new_rows)
+        if cutoff:
+            expired.setdefault(cutoff, []).append(window.sat_id)
+    for cutoff, ids in expired.items():
+        for i in range(0, len(ids), ORBIT_PATH_DELETE_IDS):
+            STORAGE.delete_where("orbit_path", {
+                "satellite_id": f"in.({','.join(ids[i:i + ORBIT_PATH_DELETE_IDS])})",
+                "timestamp": f"lt.{cutoff.isoformat()}"
+            })
+    STORAGE.insert_many("orbit_path", rows)
+
+# ----------------- LATEST STATE STORE -----------------
+def states_payload(tick, encoded):
+    return b'{"tick":%d,"states":[%s]}' % (tick, b",".join(encoded))
+
+class StateStore:
+    # Latest computed state per satellite, replaced as one snapshot per tick so readers never see a partial tick
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.tick = 0
+        self.states = {}  # sat_id -> row
+        self.encoded = {}  # sat_id -> row JSON, serialized once per tick and shared by every reader
+        self.payload = states_payload(0, [])  # /states body
+        self.listeners = []  # called with (tick, encoded, payload) after each publish
+
+    def publish(self, rows):
+        with self.lock:
+            states, encoded = {}, {}
+            for row in rows:
+                states[row["satellite_id"]] = row
+                encoded[row["satellite_id"]] = json.dumps(row).encode()
+            self.tick += 1
+            self.states = states
+            self.encoded = encoded
+            self.payload = states_payload(self.tick, encoded.values())
+            tick, payload = self.tick, self.payload
+        for listener in self.listeners:
+            listener(tick, encoded, payload)
+
+    def snapshot(self):
+        with self.lock:
+            return self.tick, self.states, self.payload
+
+    def stats(self):
+        return {"tick": self.tick, "satellites": len(self.states), "payload_bytes": len(self.payload)}
+
+STATE_STORE = StateStore()
+
+# ----------------- LIVE STREAMING -----------------
+class StreamClient:
+    # One WebSocket/SSE subscriber; holds only the newest frame so a slow consumer skips ticks instead of buffering them
+    def __init__(self, sat_ids=None, max_rate=None):
+        self.sat_ids = sat_ids  # None streams every satellite
+        self.set_rate(max_rate)
+        self.frame = None
+        self.ready = asyncio.Event()
+        self.sent = 0
+        self.skipped = 0
+
+    def set_rate(self, max_rate):
+        rate = STREAM_MAX_RATE if not max_rate or max_rate <= 0 else min(max_rate, STREAM_MAX_RATE)
+        self.interval = 1 / rate
+
+    def offer(self, frame):
+        if self.frame is not None:
+            self.skipped += 1
+        self.frame = frame
+        self.ready.set()
+
+    def render(self, frame):
+        tick, encoded, payload = frame
+        if self.sat_ids is None:
+            return payload
+        return states_payload(tick, [encoded[i] for i in self.sat_ids if i in encoded])
+
+    async def frames(self, timeout=None):
+        # Yields rendered frames no faster than max_rate; None on timeout so SSE can send a heartbeat
+        last = -math.inf
+        while True:
+            try:
+                await asyncio.wait_for(self.ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                yield None
+                continue
+            wait = last + self.interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self.ready.clear()
+            frame, self.frame = self.frame, None
+            last = time.monotonic()
+            self.sent += 1
+            yield self.render(frame)
+
+class StreamHub:
+    # Fans each published tick out to subscribers on the event loop; producers may run on worker threads
+    def __init__(self, max_clients=STREAM_MAX_CLIENTS):
+        self.max_clients = max_clients
+        self.clients = set()
+        self.loop = None
+        self.frame = None
+        self.sent = 0  # totals of disconnected clients
+        self.skipped = 0
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+
+    def publish(self, tick, encoded, payload):
+        loop = self.loop
+        if loop is None or loop.is_closed():
+            return
+        with suppress(RuntimeError):
+            loop.call_soon_threadsafe(self._fanout, (tick, encoded, payload))
+
+    def _fanout(self, frame):
+        self.frame = frame
+        for client in self.clients:
+            client.offer(frame)
+
+    def subscribe(self, sat_ids=None, max_rate=None):
+        if len(self.clients) >= self.max_clients:
+            return None
+        if self.loop is None:
+            self.start()
+        client = StreamClient(sat_ids, max_rate)
+        self.clients.add(client)
+        if self.frame is not None:
+            client.offer(self.frame)  # new subscribers start from the current tick
+        return client
+
+    def unsubscribe(self, client):
+        if client in self.clients:
+            self.clients.discard(client)
+            self.sent += client.sent
+            self.skipped += client.skipped
+
+    def stats(self):
+        return {
+            "clients": len(self.clients),
+            "sent": self.sent + sum(c.sent for c in self.clients),
+            "skipped": self.skipped + sum(c.skipped for c in self.clients)
+        }
+
+STREAM_HUB = StreamHub()
+STATE_STORE.listeners.append(STREAM_HUB.publish)
 
 # ----------------- SATELLITE LOGIC -----------------
-def update_live_state(sat_obj, sat_id):
+class HistorySampler:
+    # Passes at most one row per satellite per interval, aligned to wall-clock buckets
+    def __init__(self, interval=None):
+        self.interval = STATE_HISTORY_INTERVAL if interval is None else interval
+        self.buckets = {}  # sat_id -> last bucket written
+        self.lock = threading.Lock()
+
+    def sample(self, rows, now):
+        if self.interval <= 0:
+            return rows
+        bucket = int(now.timestamp() // self.interval)
+        with self.lock:
+            due = [row for row in rows if self.buckets.get(row["satellite_id"]) != bucket]
+            for row in due:
+                self.buckets[row["satellite_id"]] = bucket
+        return due
+
+HISTORY_SAMPLER = HistorySampler()
+
+# Full-rate history: satellite_state itself in append mode, the separate history table in latest mode
+HISTORY_TABLE = STATE_HISTORY_TABLE if STATE_MODE == "latest" else "satellite_state"
+# Coarser copies of the history, filled as ticks arrive so old full-rate rows can simply be deleted
+ROLLUP_TIERS = [("_1m", 60), ("_1h", 3600)]
+ROLLUP_SAMPLERS = [(HISTORY_TABLE + suffix, HistorySampler(bucket))
+                   for suffix, bucket in ROLLUP_TIERS] if STATE_ROLLUP and HISTORY_TABLE else []
+
+def record_states(rows, now):
+    # In latest mode satellite_state holds one upserted row per satellite; history goes to its own table
+    WRITE_QUEUE.put("satellite_state", rows)
+    if STATE_MODE == "latest" and STATE_HISTORY_TABLE:
+        history = HISTORY_SAMPLER.sample(rows, now)
+        if history:
+            WRITE_QUEUE.put(STATE_HISTORY_TABLE, history)
+    for table, sampler in ROLLUP_SAMPLERS:
+        rolled = sampler.sample(rows, now)
+        if rolled:
+            WRITE_QUEUE.put(table, rolled)
+
+def update_all_live_states(propagator=None):
+    propagator = propagator or PROPAGATOR
     now = datetime.now(timezone.utc)
-    jd, fr = jday(now.year, now.month, now.day,
-                  now.hour, now.minute, now.second)
-    e, r, v = sat_obj.sgp4(jd, fr)
-    if e != 0:
+    ids, lat, lon, alt, speed = propagator.states_at(now)
+    ts = now.isoformat()
+    rows = [{
+        "satellite_id": sat_id,
+        "latitude": la,
+        "longitude": lo,
+        "altitude_km": al,
+        "velocity_kms": sp,
+        "timestamp": ts
+    } for sat_id, la, lo, al, sp in zip(ids, lat.tolist(), lon.tolist(), alt.tolist(), speed.tolist())]
+    STATE_STORE.publish(rows)
+    record_states(rows, now)
+
+def generate_orbit_path(sat_obj, sat_id, minutes=None, mode=None):
+    # minutes defaults to ORBIT_PATH_MINUTES
+    STORAGE.delete("orbit_path", "satellite_id", sat_id)
+    if (mode or ORBIT_PATH_MODE) == "incremental":
+        window = OrbitPathWindow(sat_obj, sat_id, minutes)
+        _, rows = window.advance()
+        STORAGE.insert_many("orbit_path", rows)
+        ORBIT_WINDOWS[sat_id] = window
         return
-    lat, lon, alt = eci_to_latlon(r)
-    speed = math.sqrt(v[0]**2 + v[1]**2 + v[2]**2)
-    supabase_insert("satellite_state", {
+    grid = time_grid(datetime.now(timezone.utc), 30, (minutes or ORBIT_PATH_MINUTES) * 2)
+    e, r, _ = sat_obj.sgp4_array(grid.jd, grid.fr)
+    ok = np.flatnonzero(e == 0)
+    lat, lon, alt = eci_to_latlon_array(teme_to_ecef(r[ok], theta=grid.theta[ok]))
+    STORAGE.insert_many("orbit_path", [{
         "satellite_id": sat_id,
-        "latitude": lat,
-        "longitude": lon,
-        "altitude_km": alt,
-        "velocity_kms": speed,
-        "timestamp": now.isoformat()
-    })
-
-def generate_orbit_path(sat_obj, sat_id, minutes=30):
-    supabase_delete("orbit_path", "satellite_id", sat_id)
-    start = datetime.now(timezone.utc)
-    for i in range(0, minutes * 60, 30):
-        t = start + timedelta(seconds=i)
-        jd, fr = jday(t.year, t.month, t.day, t.hour, t.minute, t.second)
-        e, r, _ = sat_obj.sgp4(jd, fr)
-        if e != 0:
-            continue
-        lat, lon, alt = eci_to_latlon(r)
-        supabase_insert("orbit_path", {
-            "satellite_id": sat_id,
-            "latitude": lat,
-            "longitude": lon,
-            "altitude_km": alt,
-            "timestamp": t.isoformat()
-        })
+        "latitude": float(lat[n]),
+        "longitude": float(lon[n]),
+        "altitude_km": float(alt[n]),
+        "timestamp": grid.iso(i)
+    } for n, i in enumerate(ok)])
 
-def predict_passes(sat_obj, sat_id, hours=24):
-    supabase_delete("passes", "satellite_id", sat_id)
-    t = datetime.now(timezone.utc)
-    end = t + timedelta(hours=hours)
-    in_pass = False
-    aos = None
-    max_el = 0
-    while t < end:
-        jd, fr = jday(t.year, t.month, t.day, t.hour, t.minute, t.second)
-        e, r, _ = sat_obj.sgp4(jd, fr)
-        if e != 0:
-            t += timedelta(seconds=20)
+def scan_passes_bruteforce(sat_obj, start, end, step=20, carry=None):
+    # Returns (closed passes, pass still open at `end` or None); `carry` is an
+    # open pass handed over from the previous window
+    passes = []
+    in_pass = carry is not None
+    aos = carry["aos"] if carry else None
+    max_el = carry["max_elevation_deg"] if carry else 0
+    grid = time_grid(start, step, max(math.ceil((end - start).total_seconds() / step), 0))
+    e, r, _ = sat_obj.sgp4_array(grid.jd, grid.fr)
+    els = DEFAULT_STATION.look_angles(teme_to_ecef(np.nan_to_num(r), theta=grid.theta))[1]
+    for i in range(len(grid)):
+        if e[i] != 0:
             continue
-        el = elevation_angle(r)
+        el = float(els[i])
         if el > MIN_ELEV and not in_pass:
-            aos = t
+            aos = grid.time(i)
             max_el = el
             in_pass = True
         elif el > MIN_ELEV:
             max_el = max(max_el, el)
         elif el <= MIN_ELEV and in_pass:
-            supabase_insert("passes", {
-                "satellite_id": sat_id,
-                "aos": aos.isoformat(),
-                "los": t.isoformat(),
-                "max_elevation_deg": max_el,
-                "duration_sec": int((t - aos).total_seconds())
-            })
+            passes.append({"aos": aos, "los": grid.time(i), "max_elevation_deg": max_el})
             in_pass = False
-        t += timedelta(seconds=20)
+    open_pass = {"aos": aos, "max_elevation_deg": max_el} if in_pass else None
+    return passes, open_pass
+
+# ----------------- ROOT FINDING -----------------
+def brent_root(f, a, b, fa=None, fb=None, tol=0.1, max_iter=60):
+    # Brent's method on a bracket [a, b] with f(a), f(b) of opposite sign
+    fa = f(a) if fa is None else fa
+    fb = f(b) if fb is None else fb
+    if fa == 0:
+        return a
+    if fb == 0:
+        return b
+    if fa * fb > 0:
+        raise ValueError("root is not bracketed")
+    if abs(fa) < abs(fb):
+        a, b, fa, fb = b, a, fb, fa
+    c, fc = a, fa
+    d = e = b - a
+    for _ in range(max_iter):
+        if fb == 0 or abs(b - a) <= tol:
+            return b
+        if fa != fc and fb != fc:
+            # inverse quadratic interpolation
+            s = (a * fb * fc / ((fa - fb) * (fa - fc))
+                 + b * fa * fc / ((fb - fa) * (fb - fc))
+                 + c * fa * fb / ((fc - fa) * (fc - fb)))
+        else:
+            s = b - fb * (b - a) / (fb - fa)
+        lo, hi = sorted(((3 * a + b) / 4, b))
+        if (not lo < s < hi
+                or (e == d and abs(s - b) >= abs(b - c) / 2)
+                or (e != d and abs(s - b) >= abs(c - d) / 2)):
+            s = (a + b) / 2
+            e = d = b - a
+        else:
+            e, d = d, b - c
+        fs = f(s)
+        c, fc = b, fb
+        if fa * fs < 0:
+            b, fb = s, fs
+        else:
+            a, fa = s, fs
+        if abs(fa) < abs(fb):
+            a, b, fa, fb = b, a, fb, fa
+    return b
+
+GOLDEN = (math.sqrt(5) - 1) / 2
+
+def golden_max(f, a, b, tol=1.0):
+    # Golden-section search for the maximum of a unimodal f on [a, b]
+    c = b - GOLDEN * (b - a)
+    d = a + GOLDEN * (b - a)
+    fc, fd = f(c), f(d)
+    while b - a > tol:
+        if fc > fd:
+            b, d, fd = d, c, fc
+            c = b - GOLDEN * (b - a)
+            fc = f(c)
+        else:
+            a, c, fc = c, d, fd
+            d = a + GOLDEN * (b - a)
+            fd = f(d)
+    return (c, fc) if fc > fd else (d, fd)
+
+# ----------------- PASS PREDICTION -----------------
+PASS_MODE = os.getenv("PASS_MODE", "refine")  # "refine" (coarse scan + root finding), "scan" (fixed 20 s steps) or "network" (all stations)
+PASS_GRID_STEP = float(os.getenv("PASS_GRID_STEP", 20))  # seconds between samples of the shared grid in network mode
+PASS_COARSE_STEP = float(os.getenv("PASS_COARSE_STEP", 180))  # seconds between coarse samples in refine mode
+PASS_PEAK_MARGIN = float(os.getenv("PASS_PEAK_MARGIN", 10))  # degrees below MIN_ELEV a coarse peak may sit and still be refined
+
+def scan_passes_refined(sat_obj, start, end, step=None, carry=None):
+    # Same contract as scan_passes_bruteforce
+    step = step or PASS_COARSE_STEP
+    span = (end - start).total_seconds()
+    jd0, fr0 = jday_datetime(start)
+
+    def elev(offset):
+        fr = fr0 + offset / 86400.0
+        e, r, _ = sat_obj.sgp4(jd0, fr)
+        return elevation_angle(teme_to_ecef(r, jd0, fr)) if e == 0 else -90.0
+
+    def f(offset):
+        return elev(offset) - MIN_ELEV
+
+    def at(offset):
+        return start + timedelta(seconds=float(offset))
+
+    grid = time_grid(start, step, math.ceil(span / step))
+    e, r, _ = sat_obj.sgp4_array(grid.jd, grid.fr)
+    coarse = DEFAULT_STATION.look_angles(teme_to_ecef(np.nan_to_num(r), theta=grid.theta))[1]
+    offsets = grid.offsets.tolist() + [span]
+    els = np.where(e == 0, coarse, -90.0).tolist() + [elev(span)]
+    n = len(offsets)
+    passes = []
+    open_pass = None
+    if carry and els[0] <= MIN_ELEV:
+        # the carried pass ended right at the window boundary
+        passes.append({"aos": carry["aos"], "los": start, "max_elevation_deg": carry["max_elevation_deg"]})
+        carry = None
+    last_los = -1.0
+    for i in range(n - 1):
+        rising = i == 0 or els[i] >= els[i - 1]
+        if not (rising and els[i] > els[i + 1]):
+            continue
+        if els[i] <= MIN_ELEV - PASS_PEAK_MARGIN:
+            continue
+        lo = offsets[i - 1] if i > 0 else offsets[0]
+        t_max, max_el = golden_max(elev, lo, offsets[i + 1])
+        if max_el <= MIN_ELEV or t_max <= last_los:
+            continue
+        # AOS: walk back to the last coarse sample below the threshold, then refine
+        aos = None
+        if i == 0:
+            j = -1
+            if els[0] <= MIN_ELEV:
+                aos = at(brent_root(f, offsets[0], t_max, fa=els[0] - MIN_ELEV))
+        else:
+            j = i - 1
+            while j >= 0 and els[j] > MIN_ELEV:
+                j -= 1
+        if aos is None and j < 0:
+            # pass already in progress at the start of the window
+            aos = carry["aos"] if carry else start
+            if carry:
+                max_el = max(max_el, carry["max_elevation_deg"])
+        elif aos is None:
+            hi = t_max if j == i - 1 else offsets[j + 1]
+            aos = at(brent_root(f, offsets[j], hi, fa=els[j] - MIN_ELEV))
+        # LOS: walk forward to the first coarse sample below the threshold, then refine
+        k = i + 1
+        while k < n and els[k] > MIN_ELEV:
+            k += 1
+        if k >= n:
+            open_pass = {"aos": aos, "max_elevation_deg": max(max_el, max(els[i + 1:]))}
+            break
+        lo = t_max if k == i + 1 else offsets[k - 1]
+        los = brent_root(f, lo, offsets[k], fb=els[k] - MIN_ELEV)
+        last_los = los
+        passes.append({"aos": aos, "los": at(los), "max_elevation_deg": max_el})
+    if open_pass is None and els[-1] > MIN_ELEV and offsets[-1] > last_los:
+        # still rising at the end of the window: no peak found yet
+        j = n - 1
+        while j >= 0 and els[j] > MIN_ELEV:
+            j -= 1
+        if j < 0:
+            aos = carry["aos"] if carry else start
+            max_el = max(els + ([carry["max_elevation_deg"]] if carry else []))
+        else:
+            aos = at(brent_root(f, offsets[j], offsets[j + 1], fa=els[j] - MIN_ELEV))
+            max_el = max(els[j + 1:])
+        open_pass = {"aos": aos, "max_elevation_deg": max_el}
+    return passes, open_pass
+
+def scan_passes_network(sat_obj, start, end, step=None, carry=None, stations=None):
+    # Propagates once over a shared grid and scans every ground station from the same positions.
+    # Passes carry a "station_id"; open passes and `carry` are {station_id: open pass}
+    stations = stations or list(GROUND_STATIONS.values())
+    step = step or PASS_GRID_STEP
+    count = math.ceil((end - start).total_seconds() / step)
+    if count <= 0:
+        return [], dict(carry or {})
+    grid = time_grid(start, step, count)
+    offsets = grid.offsets
+    e, r, _ = sat_obj.sgp4_array(grid.jd, grid.fr)
+    el = elevation_matrix(teme_to_ecef(np.nan_to_num(r), theta=grid.theta), stations)
+    el[:, e != 0] = -90.0
+    carry = carry or {}
+
+    def at(offset):
+        return start + timedelta(seconds=float(offset))
+
+    jd0, fr0 = jday_datetime(start)
+
+    def peak(row, lo, hi, gs):
+        # sample maximum on [lo, hi], refined by golden-section search between its neighbours
+        k = lo + int(np.argmax(row[lo:hi + 1]))
+
+        def elev(offset):
+            fr = fr0 + offset / 86400.0
+            err, r_k, _ = sat_obj.sgp4(jd0, fr)
+            return gs.elevation(teme_to_ecef(r_k, jd0, fr)) if err == 0 else -90.0
+
+        _, max_el = golden_max(elev, offsets[max(k - 1, 0)], offsets[min(k + 1, len(row) - 1)])
+        return max(max_el, float(row[k]))
+
+    passes, open_passes = [], {}
+    for s_idx, gs in enumerate(stations):
+        row = el[s_idx]
+        f = row - gs.min_elevation
+        above = f > 0
+        held = carry.get(gs.id)
+        seg = 0
+        aos = None
+        if above[0]:
+            aos = held["aos"] if held else start
+        elif held:
+            passes.append({"station_id": gs.id, "aos": held["aos"], "los": start,
+                           "max_elevation_deg": held["max_elevation_deg"]})
+        for i in np.flatnonzero(above[:-1] != above[1:]):
+            cross = at(offsets[i] + step * f[i] / (f[i] - f[i + 1]))
+            if above[i + 1]:
+                seg, aos = i + 1, cross
+                continue
+            max_el = peak(row, seg, i, gs)
+            if seg == 0 and held and above[0]:
+                max_el = max(max_el, held["max_elevation_deg"])
+            passes.append({"station_id": gs.id, "aos": aos, "los": cross, "max_elevation_deg": max_el})
+        if above[-1]:
+            max_el = peak(row, seg, len(row) - 1, gs)
+            if seg == 0 and held:
+                max_el = max(max_el, held["max_elevation_deg"])
+            open_passes[gs.id] = {"aos": aos, "max_elevation_deg": max_el}
+    return passes, open_passes
+
+PASS_SCANNERS = {
+    "scan": scan_passes_bruteforce,
+    "refine": scan_passes_refined,
+    "network": scan_passes_network,
+}
+
+def pass_rows(sat_id, passes):
+    rows = []
+    for p in passes:
+        row = {
+            "satellite_id": sat_id,
+            "aos": p["aos"].isoformat(),
+            "los": p["los"].isoformat(),
+            "max_elevation_deg": p["max_elevation_deg"],
+            "duration_sec": int((p["los"] - p["aos"]).total_seconds())
+        }
+        if "station_id" in p:
+            row["station_id"] = p["station_id"]
+        rows.append(row)
+    return rows
+
+def tle_epoch(sat_obj):
+    return sat_obj.jdsatepoch + sat_obj.jdsatepochF
+
+def encode_open_pass(open_pass):
+    # Open pass state is a single pass, or {station_id: pass} in network mode
+    if not open_pass:
+        return open_pass
+    if "aos" not in open_pass:
+        return {k: encode_open_pass(v) for k, v in open_pass.items()}
+    return {"aos": open_pass["aos"].isoformat(), "max_elevation_deg": open_pass["max_elevation_deg"]}
+
+def decode_open_pass(raw):
+    if not raw:
+        return raw
+    if "aos" not in raw:
+        return {k: decode_open_pass(v) for k, v in raw.items()}
+    return {"aos": datetime.fromisoformat(raw["aos"]), "max_elevation_deg": raw["max_elevation_deg"]}
+
+class RollingPassPredictor:
+    # Remembers how far each satellite has been scanned and only scans the new part of the horizon
+    def __init__(self, hours=None, state_file=None, mode=None):
+        self.hours = hours or PASS_HORIZON_HOURS
+        self.state_file = PASS_STATE_FILE if state_file is None else state_file
+        self.mode = mode
+        self.lock = threading.Lock()
+        self.sat_locks = {}  # sat_id -> lock held across one extend (state check, scan and insert)
+        self.state = {}  # sat_id -> {"epoch": TLE epoch JD, "mode": scanner, "scanned_to": datetime, "open": open pass or None}
+        self.load()
+
+    def extend(self, sat_obj, sat_id, now=None, hours=None):
+        # Returns the number of new passes written; calls for one satellite run one at a time
+        # (the scheduler and a catalog reload may extend the same satellite concurrently)
+        with self.lock:
+            sat_lock = self.sat_locks.setdefault(sat_id, threading.Lock())
+        with sat_lock:
+            return self._extend(sat_obj, sat_id, now, hours)
+
+    def _extend(self, sat_obj, sat_id, now, hours):
+        now = now or datetime.now(timezone.utc)
+        target = now + timedelta(hours=hours or self.hours)
+        epoch = tle_epoch(sat_obj)
+        mode = self.mode or PASS_MODE
+        with self.lock:
+            st = self.state.get(sat_id)
+        if st is None or st["epoch"] != epoch or st.get("mode") != mode or st["scanned_to"] < now:
+            # unknown, re-elemented, scanned in another mode (open pass shapes differ) or fell behind:
+            # start over from now
+            STORAGE.delete("passes", "satellite_id", sat_id)
+            st = {"epoch": epoch, "mode": mode, "scanned_to": now, "open": None}
+        if st["scanned_to"] >= target:
+            return 0
+        passes, open_pass = PASS_SCANNERS[mode](sat_obj, st["scanned_to"], target, carry=st["open"])
+        STORAGE.insert_many("passes", pass_rows(sat_id, passes))
+        with self.lock:
+            self.state[sat_id] = {"epoch": epoch, "mode": mode, "scanned_to": target, "open": open_pass}
+        return len(passes)
+
+    def extend_all(self, instances=None):
+        now = datetime.now(timezone.utc)
+        for s in list(instances or SAT_INSTANCES):
+            self.extend(s["sat"], s["id"], now=now)
+        self.save()
+
+    def forget(self, sat_id):
+        with self.lock:
+            self.state.pop(sat_id, None)
+
+    def load(self):
+        if not self.state_file or not os.path.exists(self.state_file):
+            return
+        try:
+            with open(self.state_file) as f:
+                raw = json.load(f)
+        except (OSError, ValueError) as exc:
+            print(f"[ERROR] Load {self.state_file}: {exc}")
+            return
+        for sat_id, st in raw.items():
+            self.state[sat_id] = {"epoch": st["epoch"],
+                                  "mode": st.get("mode"),
+                                  "scanned_to": datetime.fromisoformat(st["scanned_to"]),
+                                  "open": decode_open_pass(st.get("open"))}
+
+    def save(self):
+        if not self.state_file:
+            return
+        with self.lock:
+            raw = {sat_id: {
+                "epoch": st["epoch"],
+                "mode": st["mode"],
+                "scanned_to": st["scanned_to"].isoformat(),
+                "open": encode_open_pass(st["open"])
+            } for sat_id, st in self.state.items()}
+        tmp = self.state_file + ".tmp"
+        try:
+            with open(tmp, "w") as f:
+                json.dump(raw, f)
+            os.replace(tmp, self.state_file)
+        except OSError as exc:
+            print(f"[ERROR] Save {self.state_file}: {exc}")
+
+PASS_PREDICTOR = RollingPassPredictor()
+
+def predict_passes(sat_obj, sat_id, hours=None, mode=None):
+    # hours defaults to PASS_HORIZON_HOURS
+    if PASS_HORIZON_MODE == "rolling":
+        PASS_PREDICTOR.extend(sat_obj, sat_id, hours=hours)
+        return
+    STORAGE.delete("passes", "satellite_id", sat_id)
+    start = datetime.now(timezone.utc)
+    end = start + timedelta(hours=hours or PASS_HORIZON_HOURS)
+    passes, _ = PASS_SCANNERS[mode or PASS_MODE](sat_obj, start, end)
+    STORAGE.insert_many("passes", pass_rows(sat_id, passes))
+
+# ----------------- AUTO UPDATE LOOP -----------------
+class TickScheduler:
+    # Runs job on a fixed monotonic deadline grid, so work time does not stretch the period
+    def __init__(self, interval, job, policy=None, max_catchup=None, name="Update"):
+        self.name = name
+        self.interval = interval
+        self.job = job
+        self.policy = policy or UPDATE_POLICY
+        self.max_catchup = UPDATE_MAX_CATCHUP if max_catchup is None else max_catchup
+        self.ticks = 0
+        self.missed = 0
+        self.overruns = 0
+        self.errors = 0
+        self.last_duration = 0.0
+        self.last_lateness = 0.0
+        self.max_lateness = 0.0
+
+    async def run(self, delay=0):
+        deadline = time.monotonic() + delay
+        while True:
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            started = time.monotonic()
+            self.last_lateness = max(started - deadline, 0.0)
+            self.max_lateness = max(self.max_lateness, self.last_lateness)
+            try:
+                await asyncio.to_thread(self.job)
+            except Exception as exc:
+                self.errors += 1
+                print(f"[ERROR] {self.name} tick: {exc}")
+            finished = time.monotonic()
+            self.ticks += 1
+            self.last_duration = finished - started
+            if self.last_duration > self.interval:
+                self.overruns += 1
+                print(f"[WARN] {self.name} tick overran: {self.last_duration:.2f}s > {self.interval}s")
+            deadline += self.interval
+            if finished < deadline:
+                continue
+            behind = int((finished - deadline) // self.interval) + 1
+            replay = min(behind, self.max_catchup) if self.policy == "catchup" else 0
+            skipped = behind - replay
+            if skipped:
+                self.missed += skipped
+                deadline += skipped * self.interval
+                print(f"[WARN] Skipped {skipped} missed {self.name.lower()} tick(s)")
+
+    def stats(self):
+        return {
+            "interval": self.interval,
+            "policy": self.policy,
+            "ticks": self.ticks,
+            "missed": self.missed,
+            "overruns": self.overruns,
+            "errors": self.errors,
+            "last_duration_sec": self.last_duration,
+            "last_lateness_sec": self.last_lateness,
+            "max_lateness_sec": self.max_lateness
+        }
+
+UPDATE_SCHEDULER = TickScheduler(UPDATE_INTERVAL, update_all_live_states)
+ORBIT_PATH_SCHEDULER = TickScheduler(ORBIT_PATH_REFRESH, refresh_orbit_paths, policy="skip", name="Orbit path")
+PASS_SCHEDULER = TickScheduler(PASS_EXTEND_INTERVAL, PASS_PREDICTOR.extend_all, policy="skip", name="Pass horizon")
+
+# ----------------- BACKGROUND PRECOMPUTATION -----------------
+class PrecomputeJob:
+    # Generates orbit paths & passes for a set of satellites on a worker pool, tracking progress
+    def __init__(self, workers=None):
+        self.workers = workers or PRECOMPUTE_WORKERS
+        self.lock = threading.Lock()
+        self.executor = None
+        self.total = 0
+        self.done = 0
+        self.failed = []
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def ready(self):
+        return self.finished_at is not None
+
+    def run(self, instances):
+        with self.lock:
+            self.total = len(instances)
+            self.done = 0
+            self.failed = []
+            self.started_at = datetime.now(timezone.utc)
+            self.finished_at = None
+        print(f"Generating orbit paths & passes for {len(instances)} satellites...")
+        with ThreadPoolExecutor(self.workers, thread_name_prefix="precompute") as executor:
+            self.executor = executor
+            futures = {executor.submit(self._precompute, s): s for s in instances}
+            for future in as_completed(futures):
+                s = futures[future]
+                with self.lock:
+                    self.done += 1
+                    if future.cancelled():
+                        continue
+                    if future.exception() is not None:
+                        self.failed.append(s["id"])
+                        print(f"[ERROR] Precompute {s['name']}: {future.exception()}")
+            self.executor = None
+        with self.lock:
+            self.finished_at = datetime.now(timezone.utc)
+        print(f"Precomputation complete ({self.done - len(self.failed)}/{self.total} satellites).")
+
+    def cancel(self):
+        executor = self.executor
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _precompute(self, s):
+        generate_orbit_path(s["sat"], s["id"])
+        predict_passes(s["sat"], s["id"])
+
+    def status(self):
+        with self.lock:
+            return {
+                "ready": self.ready,
+                "total": self.total,
+                "done": self.done,
+                "failed": list(self.failed),
+                "started_at": self.started_at.isoformat() if self.started_at else None,
+                "finished_at": self.finished_at.isoformat() if self.finished_at else None
+            }
+
+PRECOMPUTE = PrecomputeJob()
+
+# ----------------- CATALOG RELOAD -----------------
+class CatalogReloader:
+    # Re-reads the catalog files, swaps in the new catalog and recomputes only what changed
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.job = PrecomputeJob()
+        self.queue_lock = threading.Lock()
+        self.queued = {}  # sat_id -> instance waiting for recompute; newest elements win
+        self.worker = None  # the single thread running self.job
+        self.signature = None
+        self.last = None
+        if CATALOG_FILES:
+            with suppress(OSError):
+                self.signature = self.file_signature(catalog_paths())
+
+    def file_signature(self, paths):
+        return tuple((p, os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in paths)
+
+    def reload(self, paths=None):
+        global SAT_INSTANCES, PROPAGATOR
+        paths = paths or catalog_paths()
+        with self.lock:
+            self.signature = self.file_signature(paths)
+            current = {s["id"]: s for s in SAT_INSTANCES}
+            catalog = load_catalog(paths, reuse=current)
+            if not catalog:
+                raise ValueError("reloaded catalog is empty")
+            changed, added = [], []
+            for s in catalog:
+                held = current.pop(s["id"], None)
+                if held is None:
+                    added.append(s)
+                elif held["elements_hash"] != s["elements_hash"]:
+                    changed.append(s)
+            removed = list(current)
+            SAT_INSTANCES = catalog
+            PROPAGATOR = CatalogPropagator(catalog)
+            with self.queue_lock:
+                for sat_id in removed:
+                    self.queued.pop(sat_id, None)
+            for sat_id in removed:
+                ORBIT_WINDOWS.pop(sat_id, None)
+                PASS_PREDICTOR.forget(sat_id)
+                EPHEMERIS.invalidate(sat_id)
+                POSITION_CACHE.invalidate(sat_id)
+                STORAGE.delete("orbit_path", "satellite_id", sat_id)
+                STORAGE.delete("passes", "satellite_id", sat_id)
+                if STATE_MODE == "latest":
+                    STORAGE.delete("satellite_state", "satellite_id", sat_id)
+            for s in changed:
+                PASS_PREDICTOR.forget(s["id"])
+                EPHEMERIS.invalidate(s["id"])
+                POSITION_CACHE.invalidate(s["id"])
+            self.last = {
+                "at": datetime.now(timezone.utc).isoformat(),
+                "total": len(catalog),
+                "added": len(added),
+                "changed": len(changed),
+                "removed": len(removed),
+                "unchanged": len(catalog) - len(added) - len(changed)
+            }
+        print(f"Catalog reloaded: {self.last}")
+        if CATALOG_CACHE_DIR:
+            with suppress(OSError):
+                save_catalog_snapshot(os.path.join(CATALOG_CACHE_DIR, f"catalog-{catalog_hash(paths)}.npz"), catalog)
+        if added or changed:
+            self._schedule(added + changed)
+        return self.last
+
+    def _schedule(self, instances):
+        # Recomputes run one at a time on a single worker; reloads during a run queue up behind it
+        with self.queue_lock:
+            for s in instances:
+                self.queued[s["id"]] = s
+            if self.worker is not None:
+                return
+            self.worker = threading.Thread(target=self._recompute, name="catalog-reload", daemon=True)
+            self.worker.start()
+
+    def _recompute(self):
+        while True:
+            with self.queue_lock:
+                if not self.queued:
+                    self.worker = None
+                    return
+                instances = list(self.queued.values())
+                self.queued.clear()
+            self.job.run(instances)
+            PASS_PREDICTOR.save()
+
+    def watch(self):
+        # TickScheduler job: reload when any catalog file's mtime or size changes
+        paths = catalog_paths()
+        try:
+            signature = self.file_signature(paths)
+        except OSError as exc:
+            print(f"[ERROR] Catalog watch: {exc}")
+            return
+        if self.signature is None:
+            self.signature = signature
+        elif signature != self.signature:
+            self.reload(paths)
+
+    def status(self):
+        with self.queue_lock:
+            queued = len(self.queued)
+        return {"last_reload": self.last, "recompute": self.job.status(), "queued": queued}
+
+CATALOG_RELOADER = CatalogReloader()
+CATALOG_WATCH_SCHEDULER = TickScheduler(CATALOG_WATCH_INTERVAL or 60, CATALOG_RELOADER.watch, policy="skip", name="Catalog watch")
+
+# ----------------- RETENTION -----------------
+def postgrest_time(t):
+    # Whole seconds with an explicit offset, so it also orders correctly against ISO strings in local sinks
+    return t.replace(microsecond=0).isoformat()
+
+class RetentionWorker:
+    # Deletes history past its tier's age in bounded time slices, oldest first.
+    # Rollup tiers are written at ingest, so dropping full-rate rows leaves the coarse copies behind.
+    def __init__(self, slice_sec=None, max_slices=None):
+        self.slice = timedelta(seconds=slice_sec or RETENTION_SLICE)
+        self.max_slices = max_slices or RETENTION_MAX_SLICES
+        self.last = None
+        self.deleted_slices = 0
+        self.failures = 0
+
+    def policies(self):
+        # (table, max age) pairs; a zero age keeps that table forever
+        policies = [(HISTORY_TABLE, timedelta(hours=RETENTION_RAW_HOURS))] if HISTORY_TABLE else []
+        if ROLLUP_SAMPLERS:
+            policies += [(ROLLUP_SAMPLERS[0][0], timedelta(days=RETENTION_MINUTE_DAYS)),
+                         (ROLLUP_SAMPLERS[1][0], timedelta(days=RETENTION_HOUR_DAYS))]
+        return [(table, age) for table, age in policies if age.total_seconds() > 0]
+
+    def oldest(self, table):
+        rows = STORAGE.select(table, {"select": "timestamp", "order": "timestamp.asc", "limit": 1})
+        if not rows:
+            return None
+        t = rows[0]["timestamp"]
+        if isinstance(t, str):
+            t = datetime.fromisoformat(t.replace("Z", "+00:00"))
+        return t if t.tzinfo else t.replace(tzinfo=timezone.utc)
+
+    def purge(self, table, age, now):
+        # Returns the number of slices deleted; stops at the first failure so the next run retries from there
+        cutoff = now - age
+        start = self.oldest(table)
+        if start is None or start >= cutoff:
+            return 0
+        slices = 0
+        while start < cutoff and slices < self.max_slices:
+            end = min(start + self.slice, cutoff)
+            if not STORAGE.delete_where(table, {"and": f"(timestamp.gte.{postgrest_time(start)},timestamp.lt.{postgrest_time(end)})"}):
+                self.failures += 1
+                break
+            slices += 1
+            start = end
+        return slices
+
+    def run(self):
+        # TickScheduler job
+        now = datetime.now(timezone.utc)
+        result = {}
+        for table, age in self.policies():
+            result[table] = self.purge(table, age, now)
+            self.deleted_slices += result[table]
+        self.last = {"at": now.isoformat(), "slices": result}
+
+    def status(self):
+        return {
+            "enabled": bool(RETENTION_INTERVAL),
+            "policies": {table: age.total_seconds() for table, age in self.policies()},
+            "last_run": self.last,
+            "deleted_slices": self.deleted_slices,
+            "failures": self.failures
+        }
+
+RETENTION = RetentionWorker()
+SPOOL_SCHEDULER = TickScheduler(SPOOL_REPLAY_INTERVAL, SPOOL.replay if SPOOL else None, policy="skip", name="Spool replay")
+RETENTION_SCHEDULER = TickScheduler(RETENTION_INTERVAL or 3600, RETENTION.run, policy="skip", name="Retention")
+
+# ----------------- LIFESPAN -----------------
+async def extend_passes_after(precompute):
+    # The first horizon extension waits for startup precomputation to finish
+    await asyncio.shield(precompute)
+    PASS_PREDICTOR.save()
+    await PASS_SCHEDULER.run(delay=PASS_EXTEND_INTERVAL)
+
+@asynccontextmanager
+async def lifespan(app):
+    print("Starting automatic updates every", UPDATE_INTERVAL, "seconds.")
+    WRITE_QUEUE.start()
+    STREAM_HUB.start()
+    tasks = [asyncio.create_task(UPDATE_SCHEDULER.run())]
+    if ORBIT_PATH_MODE == "incremental":
+        tasks.append(asyncio.create_task(ORBIT_PATH_SCHEDULER.run()))
+    precompute = asyncio.create_task(asyncio.to_thread(PRECOMPUTE.run, SAT_INSTANCES))
+    if PASS_HORIZON_MODE == "rolling":
+        tasks.append(asyncio.create_task(extend_passes_after(precompute)))
+    if CATALOG_FILES and CATALOG_WATCH_INTERVAL:
+        tasks.append(asyncio.create_task(CATALOG_WATCH_SCHEDULER.run()))
+    if RETENTION_INTERVAL:
+        tasks.append(asyncio.create_task(RETENTION_SCHEDULER.run()))
+    if SPOOL:
+        tasks.append(asyncio.create_task(SPOOL_SCHEDULER.run(delay=SPOOL_REPLAY_INTERVAL)))
+    try:
+        yield
+    finally:
+        PRECOMPUTE.cancel()
+        for task in tasks:
+            task.cancel()
+            with suppress(asyncio.CancelledError):
+                await task
+        with suppress(Exception):
+            await precompute
+        PASS_PREDICTOR.save()
+        print("Flushing pending writes...")
+        await asyncio.to_thread(WRITE_QUEUE.stop)
+        if SPOOL:
+            SPOOL.close()
 
 # ----------------- FASTAPI -----------------
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 @app.get("/")
 def root():
     return {"message": "Satellite tracker running!"}
 
+@app.get("/ready")
+def ready():
+    status = PRECOMPUTE.status()
+    return JSONResponse(status, status_code=200 if status["ready"] else 503)
+
 @app.get("/update")
 def manual_update():
-    for s in SAT_INSTANCES:
-        update_live_state(s["sat"], s["id"])
+    update_all_live_states()
     return {"status": "updated"}
 
-# ----------------- AUTO UPDATE LOOP -----------------
-def auto_update_loop():
-    while True:
-        for s in SAT_INSTANCES:
-            update_live_state(s["sat"], s["id"])
-        time.sleep(UPDATE_INTERVAL)
-
-@app.on_event("startup")
-def startup_event():
-    print("Generating orbit paths & passes for all satellites...")
-    for s in SAT_INSTANCES:
-        generate_orbit_path(s["sat"], s["id"])
-        predict_passes(s["sat"], s["id"])
-    print("Startup complete! Starting automatic updates every", UPDATE_INTERVAL, "seconds.")
-    threading.Thread(target=auto_update_loop, daemon=True).start()
+BOOT_ID = uuid.uuid4().hex[:12]  # prefixes counter-based ETags, which restart at 0 with the process
+
+def etag_response(request, etag, body):
+    # 304 when the client already holds this version
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+@app.get("/satellites")
+def list_satellites(request: Request):
+    body = json.dumps([{
+        "id": s["id"],
+        "name": s["name"],
+        "norad_id": s.get("norad_id"),
+        "epoch": s.get("epoch")
+    } for s in SAT_INSTANCES]).encode()
+    # versioned by content, so a restart with a different catalog never matches an old ETag
+    return etag_response(request, f'"catalog-{hashlib.sha1(body).hexdigest()}"', body)
+
+@app.get("/satellites/{sat_id}/state")
+def satellite_state(sat_id: str, request: Request):
+    tick, states, _ = STATE_STORE.snapshot()
+    if sat_id not in states:
+        raise HTTPException(404, f"No state for satellite {sat_id}")
+    return etag_response(request, f'"{BOOT_ID}-tick-{tick}"', json.dumps({"tick": tick, **states[sat_id]}).encode())
+
+@app.get("/states")
+def all_states(request: Request):
+    tick, _, payload = STATE_STORE.snapshot()
+    return etag_response(request, f'"{BOOT_ID}-tick-{tick}"', payload)
+
+def satellite_entry(sat_id):
+    entry = PROPAGATOR.by_id.get(sat_id)
+    if entry is None:
+        raise HTTPException(404, f"Unknown satellite {sat_id}")
+    return entry
+
+def query_times(at=None, start=None, end=None, step=None):
+    # Either a comma-separated list of timestamps or a start/end/step range
+    try:
+        if at:
+            times = [parse_time(t) for t in at.split(",") if t.strip()]
+        else:
+            if start is None or end is None or not step or not math.isfinite(step) or step <= 0:
+                raise HTTPException(400, "Pass either at=... or start, end and a positive finite step")
+            t0, t1 = parse_time(start), parse_time(end)
+            if t1 < t0 or (t1 - t0) / step >= POSITION_MAX_POINTS:
+                raise HTTPException(400, f"Range must be ordered and at most {POSITION_MAX_POINTS} points")
+            times = (t0 + np.arange(int((t1 - t0) // step) + 1) * step).tolist()
+    except ValueError as exc:
+        raise HTTPException(400, f"Invalid timestamp: {exc}")
+    if not times or len(times) > POSITION_MAX_POINTS:
+        raise HTTPException(400, f"Between 1 and {POSITION_MAX_POINTS} timestamps are allowed")
+    return times
+
+@app.get("/satellites/{sat_id}/position")
+def satellite_position(sat_id: str, at: str = None):
+    entry = satellite_entry(sat_id)
+    times = query_times(at) if at else [time.time()]
+    if len(times) > 1:
+        raise HTTPException(400, "Pass a single timestamp; use /positions for several")
+    return {"satellite_id": sat_id, **POSITION_CACHE.positions(entry, times)[0]}
+
+@app.get("/satellites/{sat_id}/positions")
+def satellite_positions(sat_id: str, at: str = None, start: str = None, end: str = None, step: float = None):
+    entry = satellite_entry(sat_id)
+    times = query_times(at, start, end, step)
+    return {"satellite_id": sat_id, "positions": POSITION_CACHE.positions(entry, times)}
+
+def parse_sat_ids(ids):
+    # Comma-separated string or list; empty means every satellite
+    if isinstance(ids, str):
+        ids = ids.split(",")
+    ids = [i.strip() for i in ids or [] if i and i.strip()]
+    return ids or None
+
+@app.get("/stream")
+async def stream_states(request: Request, ids: str = None, max_rate: float = None):
+    client = STREAM_HUB.subscribe(parse_sat_ids(ids), max_rate)
+    if client is None:
+        raise HTTPException(503, "Too many stream clients")
+
+    async def events():
+        try:
+            async for frame in client.frames(STREAM_HEARTBEAT):
+                if await request.is_disconnected():
+                    break
+                yield b": keep-alive\n\n" if frame is None else b"data: " + frame + b"\n\n"
+        finally:
+            STREAM_HUB.unsubscribe(client)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@app.websocket("/ws")
+async def websocket_states(websocket: WebSocket, ids: str = None, max_rate: float = None):
+    # Clients may resubscribe at any time by sending {"ids": [...], "max_rate": n}
+    await websocket.accept()
+    client = STREAM_HUB.subscribe(parse_sat_ids(ids), max_rate)
+    if client is None:
+        await websocket.close(code=1013, reason="Too many stream clients")
+        return
+
+    async def send():
+        async for frame in client.frames():
+            await websocket.send_text(frame.decode())
+
+    sender = asyncio.create_task(send())
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                if "ids" in message:
+                    client.sat_ids = parse_sat_ids(message["ids"])
+                if "max_rate" in message:
+                    client.set_rate(float(message["max_rate"] or 0))
+            except (ValueError, TypeError, AttributeError):
+                print("[ERROR] Ignoring malformed stream subscription message")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        STREAM_HUB.unsubscribe(client)
+        sender.cancel()
+        with suppress(asyncio.CancelledError, Exception):
+            await sender
+
+@app.post("/catalog/reload")
+def reload_catalog():
+    if not CATALOG_FILES:
+        raise HTTPException(400, "No CATALOG_FILES configured; the built-in satellite list cannot be reloaded")
+    try:
+        return CATALOG_RELOADER.reload()
+    except (OSError, ValueError) as exc:
+        raise HTTPException(422, f"Catalog reload failed: {exc}")
+
+@app.get("/stats")
+def stats():
+    return {
+        "write_queue": WRITE_QUEUE.stats(),
+        "scheduler": UPDATE_SCHEDULER.stats(),
+        "orbit_path": ORBIT_PATH_SCHEDULER.stats(),
+        "pass_horizon": PASS_SCHEDULER.stats(),
+        "precompute": PRECOMPUTE.status(),
+        "catalog": CATALOG_RELOADER.status(),
+        "ephemeris": EPHEMERIS.stats(),
+        "positions": POSITION_CACHE.stats(),
+        "retention": RETENTION.status(),
+        "spool": SPOOL.stats() if SPOOL else None,
+        "state_store": STATE_STORE.stats(),
+        "stream": STREAM_HUB.stats()
+    }
 
 # ----------------- RUN (for local testing) -----------------
 if __name__ == "__main__":
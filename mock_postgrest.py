@@ -0,0 +1,294 @@
+import os, time, json, random, asyncio, operator
+from dotenv import load_dotenv
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response
+
+# In-memory stand-in for the Supabase PostgREST endpoints main.py writes to.
+# Point the tracker at it with SUPABASE_URL=http://127.0.0.1:54321 and any SUPABASE_SERVICE_KEY.
+
+# ----------------- LOAD ENV -----------------
+load_dotenv()
+
+MOCK_PORT = int(os.getenv("MOCK_PORT", 54321))
+MOCK_LATENCY_MS = float(os.getenv("MOCK_LATENCY_MS", 0))  # base latency added to every request
+MOCK_JITTER_MS = float(os.getenv("MOCK_JITTER_MS", 0))  # uniform random latency on top of the base
+MOCK_ROW_LATENCY_MS = float(os.getenv("MOCK_ROW_LATENCY_MS", 0))  # extra latency per row written
+MOCK_ERROR_RATE = float(os.getenv("MOCK_ERROR_RATE", 0))  # fraction of requests answered with 503
+MOCK_RATE_LIMIT = float(os.getenv("MOCK_RATE_LIMIT", 0))  # requests per second before 429s (0 disables)
+MOCK_BURST = int(os.getenv("MOCK_BURST", 20))  # requests allowed above the rate in a burst
+MOCK_UNIQUE = os.getenv("MOCK_UNIQUE", "")  # unique keys, e.g. "satellite_state=satellite_id;passes=satellite_id,aos"
+
+# ----------------- TABLES -----------------
+OPS = {"eq": operator.eq, "neq": operator.ne, "lt": operator.lt, "lte": operator.le, "gt": operator.gt, "gte": operator.ge}
+RESERVED = ("select", "order", "limit", "offset", "on_conflict", "columns")
+
+def parse_unique(spec):
+    # "table=a,b;table2=c" -> {table: (a, b)}
+    unique = {}
+    for part in filter(None, spec.split(";")):
+        table, columns = part.split("=", 1)
+        unique[table.strip()] = tuple(c.strip() for c in columns.split(","))
+    return unique
+
+def parse_filters(params):
+    # PostgREST filters -> [(column, op, value)]; covers eq/neq/lt/lte/gt/gte, in.(...) and and=(...)
+    conditions = []
+    for column, expr in params.multi_items():
+        if column in RESERVED:
+            continue
+        if column == "and":
+            for part in expr.strip("()").split(","):
+                col, op, value = part.split(".", 2)
+                conditions.append((col, op, value))
+            continue
+        op, value = expr.split(".", 1)
+        if op == "in":
+            value = [v.strip('"') for v in value.strip("()").split(",")]
+        elif op not in OPS:
+            raise ValueError(f"unsupported operator {op!r}")
+        conditions.append((column, op, value))
+    return conditions
+
+def matches(row, conditions):
+    for col, op, value in conditions:
+        v = row.get(col)
+        if v is None:
+            return False
+        if op == "in":
+            if str(v) not in value:
+                return False
+            continue
+        if isinstance(v, (int, float)) and not isinstance(v, bool):
+            if not OPS[op](v, float(value)):
+                return False
+        elif not OPS[op](str(v), value):
+            return False
+    return True
+
+class Table:
+    # Rows in insertion order plus the unique key declared via MOCK_UNIQUE
+    def __init__(self, name, unique=None):
+        self.name = name
+        self.rows = {}  # row id -> row
+        self.next_id = 1
+        self.indexes = {}  # key columns -> {key values: row id}
+        if unique:
+            self.indexes[unique] = {}
+
+    def _add(self, row):
+        rid = self.next_id
+        self.next_id += 1
+        self.rows[rid] = row
+        for columns, index in self.indexes.items():
+            index[tuple(row.get(c) for c in columns)] = rid
+
+    def _conflict(self, row):
+        for columns, index in self.indexes.items():
+            if tuple(row.get(c) for c in columns) in index:
+                return columns
+        return None
+
+    def insert(self, rows, on_conflict=None, resolution=None):
+        # All-or-nothing like a PostgREST bulk insert; returns (rows written, error status, error code, message)
+        key = tuple(c.strip() for c in on_conflict.split(",")) if on_conflict else None
+        if key and key not in self.indexes:
+            return 0, 400, "42P10", "there is no unique or exclusion constraint matching the ON CONFLICT specification"
+        if key is None and resolution and self.indexes:
+            key = next(iter(self.indexes))  # PostgREST falls back to the primary key
+        if not resolution:
+            for row in rows:
+                columns = self._conflict(row)
+                if columns:
+                    return 0, 409, "23505", f"duplicate key value violates unique constraint on ({', '.join(columns)})"
+            seen = set()
+            for row in rows:
+                for columns in self.indexes:
+                    k = (columns, tuple(row.get(c) for c in columns))
+                    if k in seen:
+                        return 0, 409, "23505", f"duplicate key value violates unique constraint on ({', '.join(columns)})"
+                    seen.add(k)
+        written = 0
+        for row in rows:
+            rid = self.indexes[key].get(tuple(row.get(c) for c in key)) if key else None
+            if rid is None:
+                self._add(dict(row))
+                written += 1
+            elif resolution == "merge-duplicates":
+                merged = {**self._remove(rid), **row}
+                self.rows[rid] = merged
+                for columns, index in self.indexes.items():
+                    index[tuple(merged.get(c) for c in columns)] = rid
+                written += 1
+        return written, None, None, None
+
+    def _remove(self, rid):
+        row = self.rows.pop(rid)
+        for columns, index in self.indexes.items():
+            k = tuple(row.get(c) for c in columns)
+            if index.get(k) == rid:
+                del index[k]
+        return row
+
+    def delete(self, conditions):
+        doomed = [rid for rid, row in self.rows.items() if matches(row, conditions)]
+        return [self._remove(rid) for rid in doomed]
+
+    def select(self, conditions, params):
+        rows = [row for row in self.rows.values() if matches(row, conditions)]
+        order = params.get("order")
+        for part in reversed(order.split(",") if order else []):
+            col, _, direction = part.partition(".")
+            rows.sort(key=lambda r: (r.get(col) is None, r.get(col)), reverse=direction.startswith("desc"))
+        offset = int(params.get("offset", 0))
+        limit = params.get("limit")
+        rows = rows[offset:offset + int(limit) if limit else None]
+        select = params.get("select", "*")
+        if select != "*":
+            columns = select.split(",")
+            rows = [{c: r.get(c) for c in columns} for r in rows]
+        return rows
+
+UNIQUE = parse_unique(MOCK_UNIQUE)
+TABLES = {}
+
+def table(name):
+    if name not in TABLES:
+        TABLES[name] = Table(name, UNIQUE.get(name))
+    return TABLES[name]
+
+# ----------------- FAULT INJECTION -----------------
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def take(self):
+        # Returns 0 when a request may pass, else seconds until the next token
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+BUCKET = TokenBucket(MOCK_RATE_LIMIT, MOCK_BURST) if MOCK_RATE_LIMIT > 0 else None
+
+STATS = {"requests": 0, "throttled": 0, "errors": 0, "rejected": 0, "inserted": 0, "deleted": 0, "selected": 0}
+STARTED = time.monotonic()
+
+def fault():
+    # Throttling and injected failures, checked before a request touches any table
+    if BUCKET:
+        wait = BUCKET.take()
+        if wait:
+            STATS["throttled"] += 1
+            return JSONResponse({"message": "Too many requests"}, status_code=429,
+                                headers={"Retry-After": str(max(1, round(wait)))})
+    if MOCK_ERROR_RATE and random.random() < MOCK_ERROR_RATE:
+        STATS["errors"] += 1
+        return JSONResponse({"message": "Injected failure"}, status_code=503)
+    return None
+
+async def delay(rows=0):
+    ms = MOCK_LATENCY_MS + random.uniform(0, MOCK_JITTER_MS) + rows * MOCK_ROW_LATENCY_MS
+    if ms > 0:
+        await asyncio.sleep(ms / 1000)
+
+def prefer(request):
+    # "resolution=merge-duplicates,return=minimal" -> {"resolution": ..., "return": ...}
+    values = {}
+    for part in request.headers.get("prefer", "").split(","):
+        k, _, v = part.strip().partition("=")
+        if k:
+            values[k] = v
+    return values
+
+def error(status, message, code=None):
+    STATS["rejected"] += 1
+    return JSONResponse({"message": message, "code": code}, status_code=status)
+
+# ----------------- FASTAPI -----------------
+app = FastAPI()
+
+@app.post("/rest/v1/{name}")
+async def insert(name: str, request: Request):
+    STATS["requests"] += 1
+    failed = fault()
+    if failed:
+        return failed
+    try:
+        body = json.loads(await request.body())
+    except ValueError as exc:
+        return error(400, f"Invalid JSON: {exc}", "PGRST102")
+    rows = body if isinstance(body, list) else [body]
+    if not all(isinstance(r, dict) for r in rows):
+        return error(400, "Expected an object or an array of objects", "PGRST102")
+    await delay(len(rows))
+    options = prefer(request)
+    resolution = options.get("resolution")
+    written, status, code, message = table(name).insert(rows, request.query_params.get("on_conflict"), resolution)
+    if message:
+        return error(status, message, code)
+    STATS["inserted"] += written
+    if options.get("return") == "representation":
+        return JSONResponse(rows, status_code=201)
+    return Response(status_code=201)
+
+@app.delete("/rest/v1/{name}")
+async def delete(name: str, request: Request):
+    STATS["requests"] += 1
+    failed = fault()
+    if failed:
+        return failed
+    try:
+        conditions = parse_filters(request.query_params)
+    except ValueError as exc:
+        return error(400, f"Invalid filter: {exc}", "PGRST100")
+    await delay()
+    removed = table(name).delete(conditions)
+    STATS["deleted"] += len(removed)
+    if prefer(request).get("return") == "representation":
+        return JSONResponse(removed)
+    return Response(status_code=204)
+
+@app.get("/rest/v1/{name}")
+async def select(name: str, request: Request):
+    STATS["requests"] += 1
+    failed = fault()
+    if failed:
+        return failed
+    try:
+        conditions = parse_filters(request.query_params)
+        rows = table(name).select(conditions, request.query_params)
+    except ValueError as exc:
+        return error(400, f"Invalid query: {exc}", "PGRST100")
+    await delay()
+    STATS["selected"] += len(rows)
+    return JSONResponse(rows)
+
+@app.get("/mock/stats")
+def stats():
+    elapsed = time.monotonic() - STARTED
+    return {
+        "uptime_sec": elapsed,
+        "rows_per_sec": STATS["inserted"] / elapsed if elapsed else 0.0,
+        "tables": {name: len(t.rows) for name, t in TABLES.items()},
+        **STATS
+    }
+
+@app.post("/mock/reset")
+def reset():
+    global STARTED
+    TABLES.clear()
+    for k in STATS:
+        STATS[k] = 0
+    STARTED = time.monotonic()
+    return {"status": "reset"}
+
+# ----------------- RUN -----------------
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host="127.0.0.1", port=MOCK_PORT)
@@ -0,0 +1,47 @@
+from datetime import datetime, timezone, timedelta
+import pytest
+import main
+
+ISS = main.SAT_INSTANCES[2]["sat"]
+START = datetime(2024, 1, 17, tzinfo=timezone.utc)
+END = START + timedelta(days=2)
+
+def scan_windows(scanner, hours=6, **kwargs):
+    # The same span as one START..END scan, split into rolling windows that hand open passes over
+    passes, carry = [], None
+    t = START
+    while t < END:
+        found, carry = scanner(ISS, t, t + timedelta(hours=hours), carry=carry, **kwargs)
+        passes.extend(found)
+        t += timedelta(hours=hours)
+    return passes
+
+def test_refine_matches_fine_scan():
+    refined, _ = main.scan_passes_refined(ISS, START, END)
+    reference, _ = main.scan_passes_bruteforce(ISS, START, END, step=1)
+    assert refined and len(refined) == len(reference)
+    for p, q in zip(refined, reference):
+        # the 1 s scan reports the first sample above the mask, up to 1 s after the crossing
+        assert -1.5 <= (p["aos"] - q["aos"]).total_seconds() <= 0.5
+        assert -1.5 <= (p["los"] - q["los"]).total_seconds() <= 0.5
+        assert p["max_elevation_deg"] == pytest.approx(q["max_elevation_deg"], abs=0.01)
+
+def test_network_peaks_match_refine():
+    refined, _ = main.scan_passes_refined(ISS, START, END)
+    network, _ = main.scan_passes_network(ISS, START, END, stations=[main.DEFAULT_STATION])
+    assert len(network) == len(refined)
+    for p, q in zip(network, refined):
+        assert abs((p["aos"] - q["aos"]).total_seconds()) < 1
+        assert abs((p["los"] - q["los"]).total_seconds()) < 1
+        # both peaks come from golden_max at 1 s tolerance; near zenith that is worth a few mdeg
+        assert p["max_elevation_deg"] == pytest.approx(q["max_elevation_deg"], abs=0.01)
+
+@pytest.mark.parametrize("scanner", [main.scan_passes_bruteforce, main.scan_passes_refined])
+def test_rolling_windows_match_single_scan(scanner):
+    single, _ = scanner(ISS, START, END)
+    rolled = scan_windows(scanner)
+    assert single and len(rolled) == len(single)
+    for p, q in zip(rolled, single):
+        assert abs((p["aos"] - q["aos"]).total_seconds()) < 0.2
+        assert abs((p["los"] - q["los"]).total_seconds()) < 0.2
+        assert p["max_elevation_deg"] == pytest.approx(q["max_elevation_deg"], abs=1e-6)
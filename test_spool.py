@@ -0,0 +1,113 @@
+import json, socket, threading, time
+import pytest
+import uvicorn
+import main
+import mock_postgrest
+
+@pytest.fixture(scope="module")
+def mock_url():
+    # mock_postgrest served from a background thread for the whole module
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    server = uvicorn.Server(uvicorn.Config(mock_postgrest.app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.01)
+    yield f"http://127.0.0.1:{port}"
+    server.should_exit = True
+    thread.join()
+
+@pytest.fixture
+def supabase(mock_url, monkeypatch):
+    mock_postgrest.TABLES.clear()
+    monkeypatch.setattr(mock_postgrest, "UNIQUE", {})
+    monkeypatch.setattr(main, "SPOOL_REPLAY_KEYS", {})
+    client = main.SupabaseClient(mock_url, "test", retries=0)
+    monkeypatch.setattr(main, "SUPABASE", client)
+    yield client
+    client.close()
+
+@pytest.fixture
+def spool(tmp_path):
+    spool = main.WriteSpool(str(tmp_path / "spool.db"))
+    yield spool
+    spool.close()
+
+def batch(*aos):
+    return json.dumps([{"satellite_id": "sat", "aos": a} for a in aos])
+
+def stored(table):
+    t = mock_postgrest.TABLES.get(table)
+    return sorted(r["aos"] for r in t.rows.values()) if t else []
+
+def test_append_counts_rows_and_skips_duplicates(spool):
+    assert spool.append("passes", batch(1, 2), 2)
+    assert spool.append("passes", batch(1, 2), 2)
+    assert spool.append("orbit_path", batch(3), 1)
+    stats = spool.stats()
+    assert stats["spooled"] == 3 and stats["duplicates"] == 1
+    assert stats["tables"] == {"passes": 1, "orbit_path": 1}
+    assert stats["bytes"] == len(batch(1, 2)) + len(batch(3))
+
+def test_evicts_oldest_batches_over_budget(tmp_path):
+    spool = main.WriteSpool(str(tmp_path / "spool.db"), max_mb=2 * len(batch(1, 2)) / (1024 * 1024))
+    spool.append("passes", batch(1, 2), 2)
+    spool.append("passes", batch(3, 4), 2)
+    spool.append("passes", batch(5, 6), 2)
+    stats = spool.stats()
+    assert stats["evicted"] == 2 and stats["spooled"] == 6
+    assert stats["tables"] == {"passes": 2}
+    assert stats["bytes"] <= stats["max_bytes"]
+    spool.close()
+
+def test_replay_writes_plain_inserts_in_order(supabase, spool):
+    spool.append("passes", batch(1, 2), 2)
+    spool.append("passes", batch(3), 1)
+    assert spool.replay() == 3
+    assert stored("passes") == [1, 2, 3]
+    stats = spool.stats()
+    assert stats["replayed"] == 3 and stats["rejected"] == 0
+    assert stats["tables"] == {} and stats["bytes"] == 0
+
+def test_replay_skips_rows_already_written(supabase, spool, monkeypatch):
+    monkeypatch.setattr(mock_postgrest, "UNIQUE", {"passes": ("satellite_id", "aos")})
+    monkeypatch.setattr(main, "SPOOL_REPLAY_KEYS", {"passes": "satellite_id,aos"})
+    mock_postgrest.table("passes").insert(json.loads(batch(1)))
+    spool.append("passes", batch(1, 2), 2)
+    spool.append("passes", batch(3), 1)
+    spool.replay()
+    assert stored("passes") == [1, 2, 3]
+    assert spool.stats()["replayed"] == 3
+
+def test_replay_without_constraint_falls_back_to_insert(supabase, spool, monkeypatch):
+    monkeypatch.setattr(main, "SPOOL_REPLAY_KEYS", {"passes": "satellite_id,aos"})
+    spool.append("passes", batch(1, 2), 2)
+    spool.replay()
+    assert stored("passes") == [1, 2]
+    assert spool.stats()["rejected"] == 0 and "passes" in spool.unkeyed
+
+def test_replay_keeps_batches_while_unreachable(spool, monkeypatch):
+    client = main.SupabaseClient("http://127.0.0.1:9", "test", retries=0)
+    monkeypatch.setattr(main, "SUPABASE", client)
+    spool.append("passes", batch(1, 2), 2)
+    spool.replay()
+    stats = spool.stats()
+    assert stats["tables"] == {"passes": 1} and stats["replayed"] == stats["rejected"] == 0
+    assert not spool.inflight
+    client.close()
+
+def test_put_waits_once_then_overflows():
+    kept = []
+    queue = main.WriteBehindQueue(lambda table, rows: len(rows), max_rows=10, put_timeout=0.05,
+                                  coalesce={}, overflow=lambda table, rows: kept.extend(rows) or len(rows))
+    rows = [{"n": i} for i in range(160)]
+    started = time.monotonic()
+    queue.put("satellite_state", rows)
+    assert time.monotonic() - started < 0.5
+    # the queued rows follow the overflow so the table stays in order
+    assert kept == rows
+    stats = queue.stats()
+    assert stats["depth"] == 0 and stats["enqueued"] == 10
+    assert stats["overflowed"] == 160 and stats["dropped"] == 0